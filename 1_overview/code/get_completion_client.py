@@ -2,7 +2,9 @@
 OpenAI protocol interface - works with LM Studio, Ollama, DeepSeek, OpenAI, grok, etc
 """
 import time
-from openai import OpenAI
+import asyncio
+from core.session1_foundations.llm_clients import get_openai_client, get_async_openai_client, new_async_openai_client
+from core.session1_foundations.llm_cache import is_deterministic, cache_key, get_llm_cache
 #
 # from core.config import LM_STUDIO_URL, LM_STUDIO_API_KEY
 #
@@ -40,7 +42,7 @@ model = "google/gemma-3-12b"
 
 # ------------------------------------------------------------------------
 # create a client
-client1 = OpenAI(base_url=base_url, api_key=api_key)  # html to json
+client1 = get_openai_client(base_url, api_key)  # html to json, pooled keep-alive connections
 
 
 # def get_completion_messages(messages, client=client1, model=model, max_tokens=8000):
@@ -63,7 +65,14 @@ client1 = OpenAI(base_url=base_url, api_key=api_key)  # html to json
 def get_completion_messages(messages, client=client1, model=model, max_tokens=32000, temperature=0.0):
     """
     Get the completion text from the LM Studio LLM server.
+    Deterministic calls (temperature ~0) are answered from the response cache of llm_cache when already made.
     """
+    use_cache = is_deterministic(temperature)
+    if use_cache:
+        key = cache_key(model, messages, base_url=str(client.base_url), temperature=temperature, max_tokens=max_tokens)
+        cached = get_llm_cache().get(key)
+        if cached is not None:
+            return cached
     try:
         completion = client.chat.completions.create(
             model=model,
@@ -71,26 +80,332 @@ def get_completion_messages(messages, client=client1, model=model, max_tokens=32
             temperature=temperature,
             max_tokens=max_tokens,
         )
-        return completion.choices[0].message.content.strip()
+        content = completion.choices[0].message.content.strip()
+        if use_cache and content:
+            get_llm_cache().put(key, content, model=model)
+        return content
     except Exception as e:
         print(f"⚠️ LLM call failed: {e}")
         return ""
 
 
-def get_chat_completion_stream(messages):
+class RateLimiter:
+    """
+    spaces the request starts to stay under requests_per_minute, shared by the tasks of one event loop
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def aget_completions_batch(list_of_messages, concurrency=8, requests_per_minute=None, client=None, model=model,
+                                 max_tokens=32000, temperature=0.0, report_every=10):
+    """
+    Run many independent conversations concurrently on the async OpenAI client, e.g. one summary per source file.
+    Deterministic calls (temperature ~0) go through the response cache of llm_cache, like get_completion_messages().
+    :param list_of_messages: list of messages lists, one per conversation
+    :param concurrency: max number of requests in flight
+    :param requests_per_minute: max request rate, None for no limit other than concurrency
+    :param client: AsyncOpenAI client, a new one on base_url / api_key (closed at the end) when None
+    :param report_every: print progress and throughput every report_every finished items, 0 for no report
+    :return: list in the order of list_of_messages: the completion text, or the exception for an item that failed
+    """
+    own_client = client is None
+    if own_client:
+        client = new_async_openai_client(base_url, api_key)
+    use_cache = is_deterministic(temperature)
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+    results = [None] * len(list_of_messages)
+    stats = {"done": 0, "failed": 0, "tokens": 0}
+    t1 = time.perf_counter()
+
+    def report():
+        elapsed = time.perf_counter() - t1
+        print(f"{stats['done']}/{len(results)} done, {stats['failed']} failed, "
+              f"{stats['done'] / elapsed:.2f} req/s, {stats['tokens'] / elapsed:.1f} completion tokens/s")
+
+    def finished():
+        stats["done"] += 1
+        if report_every and (stats["done"] % report_every == 0 or stats["done"] == len(results)):
+            report()
+
+    async def run(i, messages):
+        key = None
+        if use_cache:
+            key = cache_key(model, messages, base_url=str(client.base_url), temperature=temperature,
+                            max_tokens=max_tokens)
+            cached = get_llm_cache().get(key)
+            if cached is not None:  # no request, the semaphore and the rate limit are not used
+                results[i] = cached
+                finished()
+                return
+        async with semaphore:
+            if limiter is not None:
+                await limiter.wait()
+            try:
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                )
+                results[i] = completion.choices[0].message.content.strip()
+                if completion.usage is not None:
+                    stats["tokens"] += completion.usage.completion_tokens
+                if key is not None and results[i]:
+                    get_llm_cache().put(key, results[i], model=model)
+            except Exception as e:  # a failed item does not stop the others
+                print(f"⚠️ LLM call {i} failed: {e}")
+                results[i] = e
+                stats["failed"] += 1
+            finished()
+
+    try:
+        await asyncio.gather(*(run(i, messages) for i, messages in enumerate(list_of_messages)))
+    finally:
+        if own_client:
+            await client.close()
+    return results
+
+
+def get_completions_batch(list_of_messages, concurrency=8, requests_per_minute=None, **kwargs):
+    """
+    Synchronous entry point of aget_completions_batch(), use the async one from code already running an event loop
+    :return: list of completion texts (or exceptions for the failed items) in the order of list_of_messages
+    """
+    return asyncio.run(aget_completions_batch(list_of_messages, concurrency=concurrency,
+                                              requests_per_minute=requests_per_minute, **kwargs))
+
+
+class TextAggregator:
+    """
+    Collects streamed chunks in a list and joins them once, instead of "text += chunk" which copies the whole text
+    on every chunk (quadratic in the length of the answer)
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self._text = None
+
+    def add(self, chunk):
+        self.chunks.append(chunk)
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = "".join(self.chunks)
+            self.chunks = [self._text] if self._text else []
+        return self._text
+
+
+class StreamStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.end = None
+        self.chunks = 0
+        self.usage = None  # prompt / completion tokens of the last chunk, when include_usage is supported
+        self.cancelled = False
+
+    def on_chunk(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.chunks += 1
+
+    @property
+    def ttft_ms(self):
+        return (self.first_token - self.start) * 1000 if self.first_token is not None else None
+
+    @property
+    def completion_tokens(self):
+        # reported by the server, else one token per content chunk
+        return self.usage.completion_tokens if self.usage is not None else self.chunks
+
+    @property
+    def tokens_per_s(self):
+        """
+        decoding rate, from the first token to the end of the stream
+        """
+        if self.first_token is None or self.end is None or self.end <= self.first_token:
+            return None
+        return self.completion_tokens / (self.end - self.first_token)
+
+    def as_dict(self):
+        return {"ttft_ms": self.ttft_ms, "tokens_per_s": self.tokens_per_s, "completion_tokens": self.completion_tokens,
+                "prompt_tokens": self.usage.prompt_tokens if self.usage is not None else None,
+                "cancelled": self.cancelled}
+
+
+def _delta(chunk, stats):
+    """
+    text of a stream chunk, or None - the usage chunk sent last with include_usage has no choices
+    """
+    if getattr(chunk, "usage", None) is not None:
+        stats.usage = chunk.usage
+    if chunk.choices and chunk.choices[0].delta.content:
+        stats.on_chunk()
+        return chunk.choices[0].delta.content
+    return None
+
+
+class _StreamBase:
+    def __init__(self, stream):
+        self.stream = stream
+        self.stats = StreamStats()
+        self.aggregator = TextAggregator()
+
+    @property
+    def text(self):
+        return self.aggregator.text
+
+    def _on_chunk(self, chunk):
+        delta = _delta(chunk, self.stats)
+        if delta:
+            self.aggregator.add(delta)
+        return delta
+
+    def _finish(self, cancelled=False):
+        if self.stats.end is None:
+            self.stats.end = time.perf_counter()
+            self.stats.cancelled = cancelled
+
+
+class ChatStream(_StreamBase):
+    """
+    Iterator over the text deltas of a streamed chat completion. The chunks are read from the connection as they
+    are consumed: a slow consumer slows the reads down (backpressure) instead of buffering the whole answer.
+    close() (or leaving a "with" block, or breaking out of a for loop over get_chat_completion_stream) cancels the
+    generation by closing the HTTP response. text holds the aggregated answer, stats the TTFT and tokens/s.
+    """
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                delta = self._on_chunk(chunk)
+                if delta:
+                    yield delta
+            self._finish()
+        finally:  # the loop was left early: close the response, the server stops generating
+            self.close()
+
+    def close(self):
+        self._finish(cancelled=True)  # no-op on the stats when the stream was read to the end
+        self.stream.close()
+
+    cancel = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncChatStream(_StreamBase):
+    """
+    async variant of ChatStream: "async for delta in stream", cancelled by aclose() or by cancelling the task
+    iterating it (the CancelledError closes the response)
+    """
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                delta = self._on_chunk(chunk)
+                if delta:
+                    yield delta
+            self._finish()
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        self._finish(cancelled=True)
+        await self.stream.close()
+
+    cancel = aclose
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+def _stream_params(max_tokens, temperature, include_usage, kwargs):
+    # a parameter set to None is not sent, the server default applies
+    params = {"max_tokens": max_tokens, "temperature": temperature, **kwargs}
+    if include_usage:
+        params["stream_options"] = {"include_usage": True}
+    return {name: value for name, value in params.items() if value is not None}
+
+
+def stream_chat_completion(messages, client=None, model=model, max_tokens=32000, temperature=0.0, include_usage=True,
+                           **kwargs):
+    """
+    Start a streamed chat completion
+    :param messages: messages for the LLM
+    :param client: OpenAI client, defaults to client1
+    :param max_tokens: None to leave it to the server
+    :param temperature: None to leave it to the server
+    :param include_usage: ask for the token usage in the last chunk, set False for servers that reject stream_options
+    :param kwargs: other chat.completions.create arguments (top_p, stop, ...)
+    :return: ChatStream, iterate it for the text deltas
+    """
+    client = client or client1
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True,
+                                            **_stream_params(max_tokens, temperature, include_usage, kwargs))
+    return ChatStream(stream)
+
+
+async def astream_chat_completion(messages, client=None, model=model, max_tokens=32000, temperature=0.0,
+                                  include_usage=True, **kwargs):
+    """
+    async variant of stream_chat_completion()
+    :param client: AsyncOpenAI client, defaults to the shared one of the endpoint (tied to the running event loop)
+    :return: AsyncChatStream, iterate it with "async for"
+    """
+    client = client or get_async_openai_client(base_url, api_key)
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                  **_stream_params(max_tokens, temperature, include_usage, kwargs))
+    return AsyncChatStream(stream)
+
+
+def get_chat_completion_stream(messages, **kwargs):
     """
     Streams back tokens for the given messages.
-    Yields chunks of text.
+    Yields chunks of text. Closing the generator (e.g. break in a for loop) cancels the generation.
+    As before stream_chat_completion() existed, no sampling parameter nor stream_options is sent unless given.
+    :param kwargs: stream_chat_completion() arguments - temperature, max_tokens, include_usage, ...
+    """
+    kwargs = {"max_tokens": None, "temperature": None, "include_usage": False, **kwargs}
+    with stream_chat_completion(messages, **kwargs) as stream:
+        yield from stream
+
+
+def stream_to_writer(messages, key="token", **kwargs):
+    """
+    For a LangGraph node: stream the completion and send every delta to the custom stream of the graph as
+    {key: delta}, consumers get the tokens as they arrive with graph.stream(..., stream_mode="custom").
+    :return: (complete text, stream stats)
     """
-    stream = client1.chat.completions.create(
-        model=model,
-        messages=messages,
-        stream=True,
-    )
+    from langgraph.config import get_stream_writer
 
-    for chunk in stream:
-        if chunk.choices[0].delta.content:
-            yield chunk.choices[0].delta.content
+    writer = get_stream_writer()
+    with stream_chat_completion(messages, **kwargs) as stream:
+        for delta in stream:
+            writer({key: delta})
+    return stream.text, stream.stats.as_dict()
 
 
 if __name__ == '__main__':
@@ -117,8 +432,9 @@ if __name__ == '__main__':
 
     # input("Enter any key to continue: ")
     #
-    # response_text = ""
-    # for token in get_chat_completion_stream(messages):
-    #     response_text += token
-    #     # print(token)
-    #     print(response_text)
+    # with stream_chat_completion(messages) as stream:
+    #     for token in stream:
+    #         print(token, end="", flush=True)
+    # response_text = stream.text  # joined once
+    # print()
+    # print(stream.stats.as_dict())
@@ -0,0 +1,183 @@
+"""
+Deterministic LLM response cache.
+Most calls here run at temperature 0 (or 0.00001): RAG answers, the outline generator and critic, the planner.
+Re-running a pipeline or a demo script pays again for generations that cannot change. Responses are stored in a
+SQLite file keyed by the sha256 of (model, messages or prompt, generation parameters, base URL of the endpoint -
+LM Studio answers with whatever model is loaded, the model name alone does not identify the generator):
+- entries expire after LLM_CACHE_TTL seconds, the least recently used are evicted above LLM_CACHE_MAX_BYTES
+- sampled calls (temperature above LLM_CACHE_MAX_TEMPERATURE, n > 1) are never cached
+- LLM_CACHE=0 disables it
+Used by get_completion_client.get_completion_messages() and, through LangChainLLMCache, by the LangChain models of
+llm_clients.get_chat_model() / get_completion_model().
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import warnings
+import threading
+
+try:
+    from langchain_core.caches import BaseCache
+    from langchain_core.load import dumps, loads
+except ImportError:  # openai SDK only: LangChainLLMCache is not available
+    BaseCache = object
+
+LLM_CACHE = os.environ.get("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache/llm_cache.sqlite")
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))  # seconds
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 512 * 1024 ** 2))  # 512 MB
+LLM_CACHE_MAX_TEMPERATURE = float(os.environ.get("LLM_CACHE_MAX_TEMPERATURE", 0.01))
+
+
+def is_deterministic(temperature=None, n=1):
+    """
+    True when a call can be served from the cache: no sampling and a single choice. A missing temperature means
+    the server default, which is sampled.
+    """
+    return LLM_CACHE and temperature is not None and temperature <= LLM_CACHE_MAX_TEMPERATURE and (n or 1) == 1
+
+
+def cache_key(model, messages, **params):
+    """
+    sha256 of the canonical JSON of the request
+    :param model: model name
+    :param messages: chat messages or prompt
+    :param params: generation parameters that change the output (max_tokens, stop, tools, ...) and the base_url
+    """
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite store of key -> response text, shared by the threads of a process (and by processes through the file)
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        self.conn.commit()
+        self.size = self._total_size()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: the cached response or None when missing or expired
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response, model=None):
+        now = time.time()
+        with self.lock:
+            # a replaced entry only changes the size by the difference with the response it replaces
+            replaced = self.conn.execute("SELECT LENGTH(CAST(response AS BLOB)) FROM responses WHERE key = ?",
+                                         (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                              (key, model, response, now, now))
+            self.size += len(response.encode("utf-8")) - (replaced[0] if replaced else 0)
+            if self.size > self.max_bytes:
+                self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        # expired entries first, then the least recently used down to 90% of the cap
+        self.conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.size = self._total_size()
+        target = int(self.max_bytes * 0.9)
+        stale = []
+        for key, size in self.conn.execute("SELECT key, LENGTH(CAST(response AS BLOB)) FROM responses ORDER BY last_used"):
+            if self.size <= target:
+                break
+            stale.append((key,))
+            self.size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def _total_size(self):
+        # LENGTH() of a TEXT value counts characters, the cap is in bytes
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(CAST(response AS BLOB))), 0) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self.size}
+
+
+class LangChainLLMCache(BaseCache):
+    """
+    LangChain cache on LLMResponseCache, given to a model with cache=... - llm_string holds the model name and the
+    generation parameters but not the endpoint, one instance per base URL. The generations are stored serialized.
+    """
+
+    def __init__(self, cache, base_url=None):
+        self.cache = cache
+        self.base_url = base_url
+
+    def lookup(self, prompt, llm_string):
+        value = self.cache.get(cache_key(llm_string, prompt, base_url=self.base_url))
+        if value is None:
+            return None
+        with warnings.catch_warnings():  # loads() is flagged beta, the values were written by update() below
+            warnings.simplefilter("ignore")
+            return loads(value)
+
+    def update(self, prompt, llm_string, return_val):
+        self.cache.put(cache_key(llm_string, prompt, base_url=self.base_url), dumps(return_val))
+
+    def clear(self, **kwargs):
+        self.cache.clear()
+
+
+_cache = None
+_langchain_caches = {}  # base URL -> LangChainLLMCache
+_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    the response cache of this process
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = LLMResponseCache()
+        return _cache
+
+
+def get_langchain_cache(base_url=None):
+    """
+    the LangChain cache of the models of an endpoint, on the response cache of this process
+    """
+    cache = get_llm_cache()
+    with _lock:
+        if base_url not in _langchain_caches:
+            _langchain_caches[base_url] = LangChainLLMCache(cache, base_url)
+        return _langchain_caches[base_url]
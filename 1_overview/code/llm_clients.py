@@ -0,0 +1,233 @@
+"""
+Shared HTTP client layer for all the OpenAI compatible LLM calls - LM Studio, Ollama, vLLM, OpenAI, ...
+Every OpenAI(...) / ChatOpenAI(...) built with its defaults opens its own connection pool, and the helpers that
+build one per call (per query, per graph node) pay the TCP (and TLS) setup on every request. The factories below
+hand out clients that all share one httpx connection pool per endpoint:
+- keep-alive connections reused across calls, modules and threads
+- pool limits tuned for long generations (LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_KEEPALIVE_EXPIRY)
+- HTTP/2 when LLM_HTTP2=1 and the h2 package is installed
+- optional cap on the number of requests in flight per endpoint (LLM_MAX_CONCURRENCY), extra requests wait
+- load balancing over the LLM_ENDPOINTS hosts when the base URL is LLM_POOL_URL (llm_router)
+Usage:
+    client = get_openai_client(base_url, api_key)           # openai SDK
+    llm = get_chat_model(base_url, api_key, model=...)      # LangChain chat model
+    llm = get_completion_model(base_url, api_key, ...)      # LangChain completion model
+"""
+import os
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from core.session1_foundations.llm_router import LLM_POOL_URL, RouterTransport, AsyncRouterTransport, get_pool, \
+    ReleasingStream, AsyncReleasingStream
+from core.session1_foundations.llm_cache import is_deterministic, get_langchain_cache
+
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 64))  # per endpoint
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", 32))  # idle connections kept open per endpoint
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 120))  # seconds
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))  # seconds
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 600))  # seconds, long generations on local servers
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "0") == "1"
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 0))  # requests in flight per endpoint, 0: no cap
+
+_clients = {}
+_lock = threading.RLock()  # reentrant: the factory of an SDK client gets its http client
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def endpoint_key(base_url):
+    """
+    scheme://host:port of a base URL, the clients of all the paths of a server share its pool
+    """
+    parts = urlsplit(base_url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+def _once(fn):
+    done = []
+
+    def wrapper():
+        if not done:
+            done.append(True)
+            fn()
+    return wrapper
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """
+    transport that lets at most max_concurrency requests in flight, a request holds its slot until its response
+    is closed
+    """
+
+    def __init__(self, transport, max_concurrency):
+        self.transport = transport
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+    def handle_request(self, request):
+        self.slots.acquire()
+        release = _once(self.slots.release)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=ReleasingStream(response.stream, release), extensions=response.extensions)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport, max_concurrency):
+        self.transport = transport
+        self.slots = asyncio.Semaphore(max_concurrency)
+
+    async def handle_async_request(self, request):
+        await self.slots.acquire()
+        release = _once(self.slots.release)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=AsyncReleasingStream(response.stream, release), extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _client_kwargs():
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                          keepalive_expiry=LLM_KEEPALIVE_EXPIRY)
+    # a request waiting for a free connection is not an error, give the pool the same patience as the read
+    timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT, pool=LLM_READ_TIMEOUT)
+    return {"limits": limits, "http2": LLM_HTTP2 and http2_available()}, timeout
+
+
+def _get(key, factory):
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = factory()
+        return client
+
+
+def get_http_client(base_url, max_concurrency=LLM_MAX_CONCURRENCY):
+    """
+    The httpx.Client of this process for the endpoint of base_url
+    :param base_url: LLM server base URL, e.g. "http://localhost:1234/v1"
+    :param max_concurrency: max number of requests in flight to that endpoint, 0 for no cap other than the pool
+    """
+    def factory():
+        transport_kwargs, timeout = _client_kwargs()
+        transport = httpx.HTTPTransport(**transport_kwargs)
+        if endpoint_key(base_url) == endpoint_key(LLM_POOL_URL):
+            transport = RouterTransport(get_pool(), transport)
+        if max_concurrency:
+            transport = LimitedTransport(transport, max_concurrency)
+        return httpx.Client(transport=transport, timeout=timeout)
+
+    return _get(("http", endpoint_key(base_url), max_concurrency), factory)
+
+
+def get_async_http_client(base_url, max_concurrency=LLM_MAX_CONCURRENCY):
+    """
+    The httpx.AsyncClient of this process for the endpoint of base_url, to be used from a single event loop
+    (e.g. the one of the MCP server)
+    """
+    def factory():
+        transport_kwargs, timeout = _client_kwargs()
+        transport = httpx.AsyncHTTPTransport(**transport_kwargs)
+        if endpoint_key(base_url) == endpoint_key(LLM_POOL_URL):
+            transport = AsyncRouterTransport(get_pool(), transport)
+        if max_concurrency:
+            transport = AsyncLimitedTransport(transport, max_concurrency)
+        return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    return _get(("async_http", endpoint_key(base_url), max_concurrency), factory)
+
+
+def get_openai_client(base_url, api_key="not-needed"):
+    """
+    openai SDK client on the shared connection pool of the endpoint, one instance per (base_url, api_key)
+    """
+    return _get(("openai", base_url, api_key),
+                lambda: OpenAI(base_url=base_url, api_key=api_key, http_client=get_http_client(base_url)))
+
+
+def get_async_openai_client(base_url, api_key="not-needed"):
+    return _get(("async_openai", base_url, api_key),
+                lambda: AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=get_async_http_client(base_url)))
+
+
+def new_async_openai_client(base_url, api_key="not-needed", max_concurrency=LLM_MAX_CONCURRENCY):
+    """
+    AsyncOpenAI client with the tuned pool of this module but not shared: for a job running its own event loop
+    (asyncio.run), the shared async clients being tied to the loop they were first used on.
+    Close it with "await client.close()" or use it as "async with".
+    """
+    transport_kwargs, timeout = _client_kwargs()
+    transport = httpx.AsyncHTTPTransport(**transport_kwargs)
+    if endpoint_key(base_url) == endpoint_key(LLM_POOL_URL):
+        transport = AsyncRouterTransport(get_pool(), transport)
+    if max_concurrency:
+        transport = AsyncLimitedTransport(transport, max_concurrency)
+    return AsyncOpenAI(base_url=base_url, api_key=api_key,
+                       http_client=httpx.AsyncClient(transport=transport, timeout=timeout))
+
+
+def _set_cache(base_url, kwargs):
+    # sampled models are never cached, an explicit cache=... argument (False, None, a cache) is kept
+    if "cache" not in kwargs and is_deterministic(kwargs.get("temperature"), kwargs.get("n", 1)):
+        kwargs["cache"] = get_langchain_cache(base_url)
+
+
+def get_chat_model(base_url, api_key="not-needed", **kwargs):
+    """
+    LangChain ChatOpenAI on the shared connection pools (sync and async) of the endpoint. Creating one per call
+    is cheap: no connection is opened. Deterministic models (temperature ~0) get the response cache of llm_cache.
+    :param kwargs: other ChatOpenAI arguments - model, temperature, max_tokens, ...
+    """
+    from langchain_openai import ChatOpenAI
+
+    _set_cache(base_url, kwargs)
+    return ChatOpenAI(base_url=base_url, api_key=api_key, http_client=get_http_client(base_url),
+                      http_async_client=get_async_http_client(base_url), **kwargs)
+
+
+def get_completion_model(base_url, api_key="not-needed", **kwargs):
+    """
+    LangChain OpenAI (completion API) on the shared connection pools of the endpoint
+    :param kwargs: other OpenAI arguments - model, temperature, max_tokens, ...
+    """
+    from langchain_openai import OpenAI as CompletionOpenAI
+
+    _set_cache(base_url, kwargs)
+    return CompletionOpenAI(base_url=base_url, api_key=api_key, http_client=get_http_client(base_url),
+                            http_async_client=get_async_http_client(base_url), **kwargs)
+
+
+def close_clients():
+    """
+    close the pooled connections of the sync clients, e.g. at the end of a script - the clients are created again
+    on next use
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        if isinstance(client, httpx.Client):
+            client.close()
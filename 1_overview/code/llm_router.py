@@ -0,0 +1,401 @@
+"""
+Load balancing across several OpenAI compatible endpoints (LM Studio / Ollama / vLLM hosts).
+The pool is given as base URLs, e.g. LLM_ENDPOINTS="http://192.168.68.122:1234/v1,http://192.168.68.108:1234/v1".
+Clients send their requests to the placeholder LLM_POOL_URL, RouterTransport rewrites each one to an endpoint:
+- least loaded: the healthy endpoint with the smallest (requests in flight + 1) * EWMA latency
+- health checks: GET <base_url>/models every LLM_HEALTH_INTERVAL seconds in a background thread
+- failover: an endpoint that fails (transport error or 5xx response) LLM_EJECT_AFTER times in a row is ejected for LLM_EJECT_SECONDS; a request is
+  retried on another endpoint when it could not be sent (connection error), or when it failed or got a 502/503/504
+  and is idempotent - GET/HEAD/OPTIONS or a POST to a stateless endpoint (completions, embeddings)
+The pooled clients of llm_clients route through it when their base URL is LLM_POOL_URL:
+    llm = get_chat_model(LLM_POOL_URL, api_key="lm-studio", model=...)
+Run this module for a demo against local stub servers.
+"""
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+LLM_ENDPOINTS = [url.strip() for url in os.environ.get("LLM_ENDPOINTS", "").split(",") if url.strip()]
+LLM_POOL_URL = os.environ.get("LLM_POOL_URL", "http://llm-pool/v1")  # placeholder base URL of the routed clients
+LLM_HEALTH_INTERVAL = float(os.environ.get("LLM_HEALTH_INTERVAL", 10))  # seconds, 0 disables the health checks
+LLM_EJECT_AFTER = int(os.environ.get("LLM_EJECT_AFTER", 2))  # consecutive failures
+LLM_EJECT_SECONDS = float(os.environ.get("LLM_EJECT_SECONDS", 30))
+LLM_ROUTER_RETRIES = int(os.environ.get("LLM_ROUTER_RETRIES", 2))  # other endpoints tried after a failure
+EWMA_ALPHA = 0.2
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+STATELESS_PATHS = ("/chat/completions", "/completions", "/embeddings")
+RETRY_STATUS = {502, 503, 504}
+
+
+class Endpoint:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.inflight = 0
+        self.ewma_ms = None  # None until the first response
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0
+        self.healthy = True
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now):
+        return self.healthy and self.ejected_until <= now
+
+    def score(self):
+        # an endpoint without latency sample yet gets the traffic first, it is measured on its first request
+        return (self.inflight + 1) * (self.ewma_ms or 1.0)
+
+    def __repr__(self):
+        return f"Endpoint({self.base_url})"
+
+
+class EndpointPool:
+    def __init__(self, endpoints, eject_after=LLM_EJECT_AFTER, eject_seconds=LLM_EJECT_SECONDS):
+        """
+        :param endpoints: list of base URLs
+        :param eject_after: consecutive failures after which an endpoint is ejected
+        :param eject_seconds: time an ejected endpoint is skipped, unless every endpoint is ejected
+        """
+        if not endpoints:
+            raise ValueError("Empty endpoint pool, set LLM_ENDPOINTS")
+        self.endpoints = [Endpoint(url) for url in endpoints]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.lock = threading.Lock()
+        self._health_thread = None
+
+    def pick(self, exclude=()):
+        """
+        reserve the least loaded available endpoint, falls back on the one ejected first when none is available
+        :param exclude: endpoints already tried for this request
+        :return: Endpoint or None when every endpoint was tried
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            available = [e for e in candidates if e.available(now)]
+            endpoint = (min(available, key=Endpoint.score) if available
+                        else min(candidates, key=lambda e: e.ejected_until))
+            endpoint.inflight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, elapsed_ms=None, ok=True):
+        """
+        end of a request: update the latency average on success, the failure count and ejection otherwise
+        """
+        with self.lock:
+            endpoint.inflight -= 1
+            if ok:
+                endpoint.failures = 0
+                if elapsed_ms is not None:
+                    endpoint.ewma_ms = elapsed_ms if endpoint.ewma_ms is None \
+                        else EWMA_ALPHA * elapsed_ms + (1 - EWMA_ALPHA) * endpoint.ewma_ms
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.eject_after:
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                print(f"LLM router: {endpoint.base_url} ejected for {self.eject_seconds:.0f}s")
+
+    def check_health(self, timeout=2.0):
+        """
+        GET /models on every endpoint, an endpoint answering is healthy again and no longer ejected
+        """
+        with httpx.Client(timeout=timeout) as client:
+            for endpoint in self.endpoints:
+                try:
+                    healthy = client.get(endpoint.base_url + "/models").status_code < 500
+                except httpx.HTTPError:
+                    healthy = False
+                with self.lock:
+                    if healthy and not endpoint.healthy:
+                        print(f"LLM router: {endpoint.base_url} is healthy again")
+                    endpoint.healthy = healthy
+                    if healthy:
+                        endpoint.failures = 0
+                        endpoint.ejected_until = 0.0
+
+    def start_health_checks(self, interval=LLM_HEALTH_INTERVAL):
+        """
+        run check_health() every interval seconds in a daemon thread, once per pool
+        """
+        if interval <= 0 or self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.check_health()
+                time.sleep(interval)
+
+        self._health_thread = threading.Thread(target=loop, name="llm-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self):
+        with self.lock:
+            return {e.base_url: {"healthy": e.healthy, "ejected": e.ejected_until > time.monotonic(),
+                                 "inflight": e.inflight, "ewma_ms": e.ewma_ms, "requests": e.requests,
+                                 "errors": e.errors} for e in self.endpoints}
+
+
+def is_idempotent(request):
+    if request.method in IDEMPOTENT_METHODS:
+        return True
+    return request.method == "POST" and request.url.path.endswith(STATELESS_PATHS)
+
+
+def route(request, endpoint, pool_url=LLM_POOL_URL):
+    """
+    copy of the request sent to the endpoint: the path after the pool URL path is appended to its base URL
+    """
+    prefix = urlsplit(pool_url).path.rstrip("/")
+    path = request.url.raw_path.decode("ascii")
+    if prefix and path.startswith(prefix):
+        path = path[len(prefix):]
+    headers = [(k, v) for k, v in request.headers.raw if k.lower() != b"host"]  # set from the new URL
+    return httpx.Request(request.method, endpoint.base_url + path, headers=headers, content=request.content,
+                         extensions=request.extensions)
+
+
+class ReleasingStream(httpx.SyncByteStream):
+    """
+    response body that calls release() once closed (streamed responses included): frees the endpoint of a routed
+    request here, the concurrency slot of a request in llm_clients.LimitedTransport
+    """
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+
+class AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.release()
+
+
+class _Attempt:
+    """
+    one try of a request on an endpoint: decides whether to retry and releases the endpoint once
+    """
+
+    def __init__(self, pool, request, retries, tried):
+        self.pool = pool
+        self.endpoint = pool.pick(exclude=tried)
+        self.last = len(tried) >= retries
+        self.idempotent = is_idempotent(request)
+        self.start = time.perf_counter()
+        self.released = False
+        if self.endpoint is not None:
+            tried.append(self.endpoint)
+
+    def release(self, ok=True, elapsed_ms=None):
+        if not self.released:
+            self.released = True
+            self.pool.release(self.endpoint, elapsed_ms=elapsed_ms, ok=ok)
+
+    def retry_error(self, error):
+        """
+        :return: True when the request must be retried on another endpoint after this transport error
+        """
+        self.release(ok=False)
+        not_sent = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+        return not self.last and (not_sent or self.idempotent)
+
+    def retry_status(self, status_code):
+        """
+        :return: True when the request must be retried on another endpoint after this response status
+        """
+        if status_code in RETRY_STATUS and self.idempotent and not self.last:
+            self.release(ok=False)
+            return True
+        return False
+
+    def response(self, response, stream_cls):
+        """
+        the latency is the time to the response headers, the endpoint stays in flight until the body is closed.
+        Any 5xx is a failure: no latency sample, and an endpoint answering 500 to every request gets ejected.
+        """
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        ok = response.status_code < 500
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=stream_cls(response.stream, lambda: self.release(ok=ok, elapsed_ms=elapsed_ms)))
+
+
+class RouterTransport(httpx.BaseTransport):
+    def __init__(self, pool, transport=None, retries=LLM_ROUTER_RETRIES, pool_url=LLM_POOL_URL):
+        """
+        :param pool: EndpointPool
+        :param transport: transport doing the actual requests, e.g. the pooled keep-alive one of llm_clients
+        :param retries: max number of other endpoints tried after a failure
+        :param pool_url: placeholder base URL the clients send their requests to
+        """
+        self.pool = pool
+        self.transport = transport or httpx.HTTPTransport()
+        self.retries = retries
+        self.pool_url = pool_url
+
+    def handle_request(self, request):
+        request.read()  # the body is sent again on a retry
+        tried = []
+        while True:
+            attempt = _Attempt(self.pool, request, self.retries, tried)
+            if attempt.endpoint is None:
+                raise httpx.ConnectError("No LLM endpoint left to try", request=request)
+            try:
+                response = self.transport.handle_request(route(request, attempt.endpoint, self.pool_url))
+            except httpx.TransportError as e:
+                if attempt.retry_error(e):
+                    continue
+                raise
+            if attempt.retry_status(response.status_code):
+                response.close()
+                continue
+            return attempt.response(response, ReleasingStream)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRouterTransport(httpx.AsyncBaseTransport):
+    def __init__(self, pool, transport=None, retries=LLM_ROUTER_RETRIES, pool_url=LLM_POOL_URL):
+        self.pool = pool
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.retries = retries
+        self.pool_url = pool_url
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        tried = []
+        while True:
+            attempt = _Attempt(self.pool, request, self.retries, tried)
+            if attempt.endpoint is None:
+                raise httpx.ConnectError("No LLM endpoint left to try", request=request)
+            try:
+                response = await self.transport.handle_async_request(route(request, attempt.endpoint, self.pool_url))
+            except httpx.TransportError as e:
+                if attempt.retry_error(e):
+                    continue
+                raise
+            if attempt.retry_status(response.status_code):
+                await response.aclose()
+                continue
+            return attempt.response(response, AsyncReleasingStream)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(endpoints=None, health_interval=LLM_HEALTH_INTERVAL):
+    """
+    The EndpointPool of this process for a list of endpoints, health checks started on first use
+    :param endpoints: list of base URLs, defaults to LLM_ENDPOINTS
+    """
+    key = tuple(endpoints or LLM_ENDPOINTS)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = EndpointPool(list(key))
+            pool.start_health_checks(health_interval)
+        return pool
+
+
+# ------------------------------------------ Demo with stub servers ------------------------------------------
+def _start_stub_server(delay, fail=False):
+    """
+    OpenAI compatible stub answering chat completions after delay seconds, or with 503 when fail is set
+    :return: (server, base URL)
+    """
+    import json
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.server.fail:
+                return self._send(503, {"error": "unavailable"})
+            self._send(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.server.fail:
+                return self._send(503, {"error": "unavailable"})
+            time.sleep(self.server.delay)
+            self._send(200, {"id": "stub", "object": "chat.completion", "created": int(time.time()),
+                             "model": "stub-model",
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": f"port {self.server.port}"}}]})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.delay, server.fail, server.port = delay, fail, server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ThreadPoolExecutor
+    from openai import OpenAI
+
+    # 1. three stub hosts: a fast one, a slow one and a failing one
+    servers = [_start_stub_server(0.05), _start_stub_server(0.2), _start_stub_server(0.05, fail=True)]
+    pool = EndpointPool([url for _, url in servers])
+    client = OpenAI(base_url=LLM_POOL_URL, api_key="stub", max_retries=0,
+                    http_client=httpx.Client(transport=RouterTransport(pool)))
+
+    def ask(i):
+        completion = client.chat.completions.create(model="stub-model", messages=[{"role": "user", "content": "hi"}])
+        return completion.choices[0].message.content
+
+    # 2. concurrent requests: the failing host is retried elsewhere then ejected, the fast host gets most traffic
+    with ThreadPoolExecutor(8) as executor:
+        answers = list(executor.map(ask, range(64)))
+    print({answer: answers.count(answer) for answer in set(answers)})
+    print(pool.stats())
+
+    # 3. the failing host recovers: the health check puts it back in the pool
+    servers[2][0].fail = False
+    pool.check_health()
+    with ThreadPoolExecutor(8) as executor:
+        answers = list(executor.map(ask, range(32)))
+    print({answer: answers.count(answer) for answer in set(answers)})
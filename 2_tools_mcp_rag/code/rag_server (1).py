@@ -1,6 +1,8 @@
-from typing import Optional
-from mcp.server.fastmcp import FastMCP
-from core.session1_foundations.model_code import do_rag
+import json
+from typing import Optional, List
+from mcp.server.fastmcp import FastMCP, Context
+from core.rag_agents.model_code import ado_rag, ado_rag_many, astream_rag, warmup_rag
+from core.rag_agents.reranker import RAG_RERANK
 
 # mcp = FastMCP("Weather")
 port = 8100
@@ -9,18 +11,64 @@ mcp = FastMCP("MyMCPService", port=port)
 
 
 @mcp.tool()
-async def rag_tool(query: str) -> Optional[str]:
+async def rag_tool(query: str, rerank: bool = RAG_RERANK) -> Optional[str]:
     """
     Given a query pertaining to nanochat code repository, perform RAG and return the results.
 
     Args:
         query: The city name or zip code to get weather for
+        rerank: Re-order the retrieved chunks with a cross-encoder before answering, slower but more precise.
 
     Returns:
         Result of the rag tool that answers to the input query.
     """
     try:
-        return do_rag(query)
+        return await ado_rag(query, rerank=rerank)
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+@mcp.tool()
+async def rag_many_tool(queries: List[str], rerank: bool = RAG_RERANK) -> str:
+    """
+    Answer several related questions pertaining to nanochat code repository in one call.
+    Prefer it to calling rag_tool repeatedly: the questions are embedded and searched together.
+
+    Args:
+        queries: List of queries pertaining to nanochat code repository.
+        rerank: Re-order the retrieved chunks with a cross-encoder before answering, slower but more precise.
+
+    Returns:
+        JSON string containing a list of {"query", "answer"} objects, in the order of the queries.
+    """
+    try:
+        results = await ado_rag_many(queries, rerank=rerank)
+        return json.dumps([{"query": q, "answer": str(r) if r else "No results found"}
+                           for q, r in zip(queries, results)], indent=2)
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+@mcp.tool()
+async def rag_stream_tool(query: str, ctx: Context, rerank: bool = RAG_RERANK) -> str:
+    """
+    Same as rag_tool, but the answer is streamed while it is generated: every token is sent to the client as a
+    progress notification (when the client asked for progress), the complete answer is returned at the end.
+
+    Args:
+        query: Query pertaining to nanochat code repository.
+        rerank: Re-order the retrieved chunks with a cross-encoder before answering, slower but more precise.
+
+    Returns:
+        Result of the rag tool that answers to the input query.
+    """
+    try:
+        chunks = []
+        async for chunk in astream_rag(query, rerank=rerank):
+            chunks.append(chunk)
+            await ctx.report_progress(progress=len(chunks), message=chunk)
+        result = "".join(chunks)
+        return result if result else "No results found"
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -30,6 +78,7 @@ if __name__ == "__main__":
     import logging
 
     logging.basicConfig(level=logging.INFO)
+    warmup_rag()
     # mcp.run(transport="streamable-http", port=8100)
     mcp.run(transport="streamable-http")
 
@@ -0,0 +1,363 @@
+"""
+IVF approximate nearest neighbour index over int8 quantized vectors - an alternative backend to Chroma for large
+corpora. The Chroma stores keep every 1024-d float32 vector in memory and search them all; this index:
+1. clusters the (unit) vectors with k-means into nlist inverted lists, rows are stored sorted by list
+2. keeps an int8 code + one float scale per vector (4x smaller than float32) to score the rows of the nprobe
+   lists closest to the query
+3. rescores the best candidates with the float32 vectors, read from a memory-mapped file: only the pages of the
+   candidate rows are touched, the OS page cache shares them between processes
+Texts and metadata live in a SQLite table next to the arrays.
+Build it from documents with create_vector_store(..., use_db="ivf") or from an existing Chroma store with
+build_from_chroma(), select it for retrieval with VECTOR_BACKEND=ivf.
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 16))  # number of inverted lists searched per query
+ANN_RESCORE_FACTOR = int(os.environ.get("ANN_RESCORE_FACTOR", 8))  # k * factor candidates rescored in float32
+EXPORT_PAGE_SIZE = 2048  # rows read from Chroma per call
+
+
+def ann_path(db_path):
+    """
+    directory of the IVF index built for the vector store at db_path
+    """
+    return db_path.rstrip("/\\") + "_ivf"
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors):
+    """
+    symmetric per-row int8 quantization
+    :return: (int8 codes, float32 scales) with vectors ~= codes * scales[:, None]
+    """
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def build_ivf_index(vectors, ids, documents, metadatas, path, nlist=None, seed=0):
+    """
+    Build and save the index
+    :param vectors: float32 matrix (n, d)
+    :param ids: list of n chunk ids
+    :param documents: list of n texts
+    :param metadatas: list of n metadata dicts
+    :param path: output directory, replaced if it exists
+    :param nlist: number of inverted lists, defaults to 4 * sqrt(n)
+    :return: path
+    """
+    t1 = time.time()
+    vectors = normalize(vectors)
+    n = len(vectors)
+    if nlist is None:
+        nlist = max(1, min(n, int(4 * np.sqrt(n))))
+
+    # 1. coarse quantizer - cosine k-means on unit vectors
+    kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=seed, batch_size=4096, n_init=1)
+    assign = kmeans.fit_predict(vectors)
+    centroids = normalize(kmeans.cluster_centers_)
+
+    # 2. rows sorted by list, a list is a contiguous slice [offsets[c], offsets[c + 1])
+    order = np.argsort(assign, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+    vectors = vectors[order]
+    codes, scales = quantize(vectors)
+
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_path, "codes.npy"), codes)
+    np.save(os.path.join(tmp_path, "scales.npy"), scales)
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+
+    # 3. texts and metadata by row
+    con = sqlite3.connect(os.path.join(tmp_path, "chunks.sqlite"))
+    con.execute("CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT, document TEXT, metadata TEXT)")
+    con.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                    ((row, ids[i], documents[i], json.dumps(metadatas[i] or {})) for row, i in enumerate(order)))
+    con.execute("CREATE INDEX chunks_id ON chunks (id)")
+    con.commit()
+    con.close()
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"IVF index: {n} vectors, {nlist} lists, built in {time.time() - t1:.1f}s at {path}")
+    return path
+
+
+def iter_chroma_pages(db_path, page_size=EXPORT_PAGE_SIZE):
+    """
+    Read a whole Chroma collection page by page, the stored embeddings are reused - nothing is re-embedded
+    :return: (number of rows, generator of (vectors, ids, documents, metadatas) pages)
+    """
+    from langchain_community.vectorstores import Chroma
+
+    collection = Chroma(persist_directory=db_path)._collection
+    count = collection.count()
+
+    def pages():
+        for offset in range(0, count, page_size):
+            page = collection.get(offset=offset, limit=page_size, include=["embeddings", "documents", "metadatas"])
+            yield np.asarray(page["embeddings"], dtype=np.float32), page["ids"], page["documents"], page["metadatas"]
+
+    return count, pages()
+
+
+def export_chroma(db_path, page_size=EXPORT_PAGE_SIZE):
+    """
+    :return: (vectors, ids, documents, metadatas) of the whole Chroma collection at db_path
+    """
+    _, pages = iter_chroma_pages(db_path, page_size)
+    vectors, ids, documents, metadatas = [], [], [], []
+    for page_vectors, page_ids, page_documents, page_metadatas in pages:
+        vectors.append(page_vectors)
+        ids.extend(page_ids)
+        documents.extend(page_documents)
+        metadatas.extend(page_metadatas)
+    return np.concatenate(vectors), ids, documents, metadatas
+
+
+def build_from_chroma(db_path, path=None, nlist=None):
+    """
+    build the IVF index of an existing Chroma store, by default next to it
+    """
+    vectors, ids, documents, metadatas = export_chroma(db_path)
+    return build_ivf_index(vectors, ids, documents, metadatas, path or ann_path(db_path), nlist=nlist)
+
+
+class IVFIndex:
+    """
+    Read only view of an index directory, the arrays are memory-mapped
+    """
+
+    def __init__(self, path, nprobe=ANN_NPROBE, rescore_factor=ANN_RESCORE_FACTOR):
+        self.path = path
+        self.nprobe = nprobe
+        self.rescore_factor = rescore_factor
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.con = sqlite3.connect(os.path.join(path, "chunks.sqlite"), check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def search(self, query_vector, k=8, nprobe=None):
+        """
+        :param query_vector: query embedding
+        :param k: number of results
+        :param nprobe: number of inverted lists searched, defaults to self.nprobe
+        :return: (rows, cosine similarities) best first
+        """
+        q = normalize(query_vector)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+
+        # 1. closest lists
+        lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+
+        # 2. approximate scores from the int8 codes of the probed lists
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists])
+        approx = np.concatenate([
+            (self.codes[self.offsets[c]:self.offsets[c + 1]].astype(np.float32) @ q)
+            * self.scales[self.offsets[c]:self.offsets[c + 1]]
+            for c in lists
+        ])
+
+        # 3. rescore the best candidates with the full precision vectors
+        return self._rescore(q, rows, approx, k)
+
+    def search_many(self, query_vectors, k=8, nprobe=None):
+        """
+        search several queries together: the centroids are scored for all of them in one matrix product and each
+        probed list is scanned once for all the queries that probe it
+        :return: list of (rows, cosine similarities) best first, one per query
+        """
+        qs = normalize(query_vectors)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(qs @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        approx = [{} for _ in range(len(qs))]  # per query: list -> approximate scores of its rows
+        for c in np.unique(probes):
+            queries = np.nonzero((probes == c).any(axis=1))[0]
+            start, end = self.offsets[c], self.offsets[c + 1]
+            scores = (self.codes[start:end].astype(np.float32) @ qs[queries].T) * self.scales[start:end, None]
+            for j, i in enumerate(queries):
+                approx[i][c] = scores[:, j]
+
+        results = []
+        for i, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists])
+            results.append(self._rescore(qs[i], rows, np.concatenate([approx[i][c] for c in lists]), k))
+        return results
+
+    def _rescore(self, q, rows, approx, k):
+        """
+        rescore the best approximate candidates with the full precision vectors
+        """
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        n_candidates = min(len(rows), k * self.rescore_factor)
+        candidates = np.sort(rows[np.argpartition(-approx, n_candidates - 1)[:n_candidates]])
+        exact = self.vectors[candidates] @ q
+        best = np.argsort(-exact)[:k]
+        return candidates[best], exact[best]
+
+    def exact_search(self, query_vector, k=8):
+        """
+        brute force search over all the float32 vectors, the reference for benchmark_recall()
+        """
+        scores = self.vectors @ normalize(query_vector)
+        best = np.argsort(-scores)[:k]
+        return best, scores[best]
+
+    def fetch(self, rows=None, ids=None):
+        """
+        :return: list of (id, document, metadata) for the given rows (in that order) or ids
+        """
+        with self.lock:
+            if rows is not None:
+                rows = [int(r) for r in rows]
+                query = f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})"
+                found = {r[0]: r[1:] for r in self.con.execute(query, rows)}
+                records = [found[r] for r in rows if r in found]
+            else:
+                query = f"SELECT id, document, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})"
+                records = list(self.con.execute(query, list(ids)))
+        return [(doc_id, document, json.loads(metadata)) for doc_id, document, metadata in records]
+
+
+class ReadOnlyVectorStore(VectorStore):
+    """
+    LangChain vector store over a read only index offering search(query_vector, k) -> (rows, scores) and
+    fetch(rows=..., ids=...) -> [(id, document, metadata)]: rebuild the index to change its content.
+    Offers the subset of the Chroma API used by the RAG models (similarity search, as_retriever, get by ids).
+    """
+
+    def __init__(self, index, embedding_function):
+        self.index = index
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        rows, scores = self.index.search(embedding, k=k)
+        records = self.index.fetch(rows=rows)
+        return [(Document(page_content=document, metadata=metadata, id=doc_id), float(score))
+                for (doc_id, document, metadata), score in zip(records, scores)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        """
+        search several query embeddings in one pass over the index, the chunks of all the results are fetched in a
+        single query
+        :return: list (one per query) of lists of documents
+        """
+        results = self.index.search_many(embeddings, k=k)
+        all_rows = sorted({int(r) for rows, _ in results for r in rows})
+        records = dict(zip(all_rows, self.index.fetch(rows=all_rows)))
+        return [[Document(page_content=records[int(r)][1], metadata=records[int(r)][2], id=records[int(r)][0])
+                 for r in rows] for rows, _ in results]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k=k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self._embedding_function.embed_query(query), k=k)
+
+    def get(self, ids=None, **kwargs):
+        """
+        Chroma compatible get by ids
+        """
+        records = self.index.fetch(ids=ids or [])
+        return {"ids": [r[0] for r in records], "documents": [r[1] for r in records],
+                "metadatas": [r[2] for r in records]}
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError(f"{type(self).__name__} is read only, rebuild it instead")
+
+    def persist(self):
+        pass  # written when built
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError(f"{cls.__name__} cannot be built from texts")
+
+
+class IVFVectorStore(ReadOnlyVectorStore):
+    def __init__(self, persist_directory, embedding_function, nprobe=ANN_NPROBE):
+        super().__init__(IVFIndex(persist_directory, nprobe=nprobe), embedding_function)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, nlist=None, **kwargs):
+        """
+        embed the texts and build the index in persist_directory
+        """
+        texts = list(texts)
+        ids = ids or [str(i) for i in range(len(texts))]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = embedding.embed_documents(texts)
+        build_ivf_index(vectors, ids, texts, metadatas, persist_directory, nlist=nlist)
+        return cls(persist_directory, embedding)
+
+
+def benchmark_recall(path, queries=None, k=8, nprobes=(1, 4, 8, 16, 32), n_queries=200, seed=0):
+    """
+    recall@k and latency of the IVF search against the exact search
+    :param path: index directory
+    :param queries: query vectors, defaults to stored vectors with some noise
+    :param k: number of results compared
+    :param nprobes: values of nprobe to benchmark
+    :return: dict nprobe -> {"recall", "ms"}, plus "exact_ms"
+    """
+    index = IVFIndex(path)
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(index), min(n_queries, len(index)), replace=False)
+        queries = np.asarray(index.vectors[np.sort(rows)])
+        queries = queries + rng.normal(scale=0.02, size=queries.shape).astype(np.float32)
+
+    t1 = time.perf_counter()
+    truth = [set(index.exact_search(q, k=k)[0].tolist()) for q in queries]
+    report = {"exact_ms": (time.perf_counter() - t1) * 1000 / len(queries)}
+
+    for nprobe in nprobes:
+        t1 = time.perf_counter()
+        found = [index.search(q, k=k, nprobe=nprobe)[0] for q in queries]
+        ms = (time.perf_counter() - t1) * 1000 / len(queries)
+        recall = np.mean([len(truth[i] & set(f.tolist())) / k for i, f in enumerate(found)])
+        report[nprobe] = {"recall": float(recall), "ms": ms}
+        print(f"nprobe={nprobe:3d}  recall@{k}={recall:.3f}  {ms:.2f} ms/query")
+    print(f"exact search: {report['exact_ms']:.2f} ms/query")
+    return report
+
+
+if __name__ == '__main__':
+    from core.rag_agents.ingest_code import DB_CHROMA_PATH
+
+    build_from_chroma(DB_CHROMA_PATH)
+    benchmark_recall(ann_path(DB_CHROMA_PATH))
@@ -0,0 +1,66 @@
+"""
+Batched multi-query retrieval.
+Agents often fire several related questions in a row, each going through retriever.invoke(): one embedding forward
+pass and one index scan per question. retrieve_many() embeds all the questions in one batch and searches them
+together:
+- Chroma: a single collection.query(query_embeddings=[...]) call
+- IVF index / snapshot (ReadOnlyVectorStore): one matrix product of the query matrix with the stored vectors
+and returns the documents of each question, in the order of the questions.
+"""
+import time
+
+from langchain_core.documents import Document
+
+from core.rag_agents.rag_metrics import METRICS
+
+
+def embed_queries(embeddings, queries):
+    """
+    embed a list of queries in one forward pass
+    :param embeddings: Langchain Embeddings, its embed_queries() is used when it has one - the models used here
+                       (gte-large) encode queries and documents the same way, embed_documents() otherwise
+    :return: list of vectors
+    """
+    embed_fn = getattr(embeddings, "embed_queries", None) or embeddings.embed_documents
+    return embed_fn(list(queries))
+
+
+def search_many(vectordb, query_vectors, k=8, filter=None):
+    """
+    similarity search of several query vectors in one call to the store
+    :param vectordb: Chroma or ReadOnlyVectorStore (IVF index, snapshot)
+    :param query_vectors: list of query embeddings
+    :param k: number of documents per query
+    :param filter: Chroma where filter, e.g. corpus_registry.collections_filter(...), not supported by the read
+                   only stores
+    :return: list (one per query) of lists of documents, best first
+    """
+    if not len(query_vectors):
+        return []
+    if hasattr(vectordb, "similarity_search_by_vectors"):  # read only stores search the query matrix at once
+        return vectordb.similarity_search_by_vectors(query_vectors, k=k)
+
+    result = vectordb._collection.query(query_embeddings=[list(map(float, v)) for v in query_vectors],
+                                        n_results=k, where=filter, include=["documents", "metadatas"])
+    return [[Document(page_content=document, metadata=metadata or {}, id=doc_id)
+             for doc_id, document, metadata in zip(ids, documents, metadatas)]
+            for ids, documents, metadatas in zip(result["ids"], result["documents"], result["metadatas"])]
+
+
+def retrieve_many(vectordb, queries, k=8, filter=None):
+    """
+    Batched equivalent of [vectordb.as_retriever(search_kwargs={"k": k}).invoke(q) for q in queries]
+    :param vectordb: vector store, e.g. get_retriever() of the model modules
+    :param queries: list of query texts
+    :param k: number of documents per query
+    :param filter: Chroma where filter
+    :return: list (one per query) of lists of documents
+    """
+    t1 = time.perf_counter()
+    query_vectors = embed_queries(vectordb.embeddings, queries)
+    t2 = time.perf_counter()
+    docs = search_many(vectordb, query_vectors, k=k, filter=filter)
+    METRICS.observe("retrieve_many.embed_ms", (t2 - t1) * 1000)
+    METRICS.observe("retrieve_many.search_ms", (time.perf_counter() - t2) * 1000)
+    METRICS.incr("retrieve_many.queries", len(queries))
+    return docs
@@ -0,0 +1,383 @@
+"""
+Structural chunker for source code - one chunk per function, class, impl block, ... instead of fixed size windows
+that cut functions in the middle of their body.
+- Python is parsed with the standard ast module: top level functions and classes become chunks, a class too big for
+  one chunk is split into its methods, a function too big for one chunk is split between two statements of its body.
+- Rust is scanned for braces outside of comments, strings and char literals: fn, struct, enum, union, impl, trait,
+  mod and macro_rules items become chunks, an impl / trait / mod too big for one chunk is split into its members,
+  a fn too big is split between two statements.
+Imports, constants and other statements found between the definitions are grouped in their own chunks.
+Every chunk carries symbol, qualified_path, kind, start_line and end_line (1 based, inclusive) in its metadata.
+"""
+import os
+import re
+import ast
+import sys
+import glob
+import time
+
+from langchain_core.documents import Document
+
+MAX_CHUNK_CHARS = int(os.environ.get("MAX_CHUNK_CHARS", 2048))  # a definition longer than this is split
+
+RUST_ITEM_RE = re.compile(
+    r"\s*(?:pub(?:\s*\([^)]*\))?\s+)?(?:(?:unsafe|async|const|default|extern(?:\s+\"[^\"]*\")?)\s+)*"
+    r"(fn|struct|enum|union|impl|trait|mod|macro_rules!)(?![A-Za-z0-9_])\s*([A-Za-z_][A-Za-z0-9_]*)?"
+)
+RUST_IMPL_RE = re.compile(r"impl\s*(?:<[^{]*?>)?\s*(.*?)\s*(?:\bwhere\b|\{|;|$)", re.S)
+RUST_TOKEN_RE = re.compile(r"""//[^\n]*|/\*|(?<![A-Za-z0-9_])b?r(#*)"|"(?:\\.|[^"\\])*"|'(?:\\.|[^\\'\n])'|[{};]""",
+                           re.S)
+RUST_LEADING_RE = re.compile(r"\s*(?:$|//|#\[|#!\[)")  # blank lines, comments and attributes attach to the next item
+
+
+class _Lines:
+    """
+    lines of a file with the char count of any line range
+    """
+
+    def __init__(self, text):
+        self.lines = text.splitlines(keepends=True)
+        self.cum = [0]
+        for line in self.lines:
+            self.cum.append(self.cum[-1] + len(line))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def chars(self, start, end):
+        return self.cum[end] - self.cum[start - 1]
+
+    def text(self, start, end):
+        return "".join(self.lines[start - 1:end])
+
+
+class _Chunker:
+    def __init__(self, text, max_chars):
+        self.lines = _Lines(text)
+        self.max_chars = max_chars
+        self.chunks = []
+
+    def emit(self, start, end, symbol, qualified_path, kind, boundaries=None):
+        """
+        add the lines start..end as one chunk, or as several parts cut after boundary lines when too long
+        """
+        while start <= end and not self.lines.lines[start - 1].strip():  # no leading blank lines
+            start += 1
+        while end >= start and not self.lines.lines[end - 1].strip():
+            end -= 1
+        if start > end:
+            return
+
+        parts = [(start, end)]
+        if self.lines.chars(start, end) > self.max_chars:
+            parts = self.split(start, end, [b for b in boundaries or [] if start <= b < end])
+        for i, (part_start, part_end) in enumerate(parts):
+            self.chunks.append({
+                "text": self.lines.text(part_start, part_end),
+                "symbol": symbol,
+                "qualified_path": qualified_path,
+                "kind": kind,
+                "start_line": part_start,
+                "end_line": part_end,
+                "part": i,
+            })
+
+    def split(self, start, end, boundaries, by_line=False):
+        """
+        greedy split of start..end in parts of at most max_chars, cut after a boundary line when possible and
+        after any line for a part that is still too long
+        """
+        parts = []
+        part_start, last_cut = start, None
+        for b in list(boundaries) + [end]:
+            if last_cut is not None and self.lines.chars(part_start, b) > self.max_chars:
+                parts.append((part_start, last_cut))
+                part_start = last_cut + 1
+            last_cut = b
+        parts.append((part_start, end))
+        if by_line:
+            return parts
+
+        result = []
+        for part_start, part_end in parts:
+            if self.lines.chars(part_start, part_end) > self.max_chars and part_end > part_start:
+                result.extend(self.split(part_start, part_end, range(part_start, part_end), by_line=True))
+            else:
+                result.append((part_start, part_end))
+        return result
+
+
+class _PythonChunker(_Chunker):
+    DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+    def run(self):
+        self.block(ast.parse("".join(self.lines.lines)).body, 1, len(self.lines), "", "<module>", "module")
+        return self.chunks
+
+    def block(self, body, lo, hi, parent, symbol, kind):
+        """
+        chunk the statements of a module or class body covering the lines lo..hi
+        """
+        cursor = lo  # first line not assigned to a chunk yet
+        group_start = group_end = None  # pending run of statements that are not definitions
+        for node in body:
+            if isinstance(node, self.DEFINITIONS):
+                if group_start is not None:
+                    self.emit(group_start, group_end, symbol, parent or symbol, kind)
+                    cursor, group_start = group_end + 1, None
+                # the comments and decorators above the definition belong to it
+                self.definition(node, cursor, node.end_lineno, parent)
+                cursor = node.end_lineno + 1
+                continue
+
+            if group_start is not None and self.lines.chars(group_start, node.end_lineno) > self.max_chars:
+                self.emit(group_start, group_end, symbol, parent or symbol, kind)
+                cursor, group_start = group_end + 1, None
+            if group_start is None:
+                group_start = cursor
+            group_end = node.end_lineno
+        if group_start is not None:
+            self.emit(group_start, max(group_end, hi), symbol, parent or symbol, kind)
+        elif cursor <= hi:  # comments or code left after the last definition
+            self.emit(cursor, hi, symbol, parent or symbol, kind)
+
+    def definition(self, node, start, end, parent):
+        qualified_path = parent + "." + node.name if parent else node.name
+        if isinstance(node, ast.ClassDef):
+            if self.lines.chars(start, end) > self.max_chars:
+                # header, docstring and class attributes in a first chunk then one chunk per method
+                self.block(node.body, start, end, qualified_path, node.name, "class")
+            else:
+                self.emit(start, end, node.name, qualified_path, "class")
+        else:
+            self.emit(start, end, node.name, qualified_path, "function",
+                      boundaries=[stmt.end_lineno for stmt in node.body])
+
+
+class _RustChunker(_Chunker):
+    def __init__(self, text, max_chars):
+        super().__init__(text, max_chars)
+        self.scan(text)
+
+    def scan(self, text):
+        """
+        brace depth at the start and end of every line, whether the line opens a brace and the depths at which it
+        has a ';' - braces and semicolons inside comments, strings and char literals are ignored
+        """
+        n = len(self.lines)
+        self.depth_start = [0] * (n + 2)
+        self.depth_end = [0] * (n + 2)
+        self.opens = [False] * (n + 2)
+        self.semis = [()] * (n + 2)
+
+        events = []
+        pos = 0
+        while True:
+            m = RUST_TOKEN_RE.search(text, pos)
+            if m is None:
+                break
+            token = m.group(0)
+            pos = m.end()
+            if token in ("{", "}", ";"):
+                events.append((m.start(), token))
+            elif token == "/*":  # block comments nest in Rust
+                nesting = 1
+                while nesting and pos < len(text):
+                    opening, closing = text.find("/*", pos), text.find("*/", pos)
+                    if closing < 0:
+                        pos = len(text)
+                    elif 0 <= opening < closing:
+                        nesting, pos = nesting + 1, opening + 2
+                    else:
+                        nesting, pos = nesting - 1, closing + 2
+            elif m.group(1) is not None:  # raw string, ends with " followed by the same number of #
+                closing = '"' + m.group(1)
+                end = text.find(closing, pos)
+                pos = len(text) if end < 0 else end + len(closing)
+
+        depth, e = 0, 0
+        for line in range(1, n + 1):
+            self.depth_start[line] = depth
+            semis = []
+            while e < len(events) and events[e][0] < self.lines.cum[line]:
+                token = events[e][1]
+                if token == "{":
+                    depth += 1
+                    self.opens[line] = True
+                elif token == "}":
+                    depth = max(0, depth - 1)
+                else:
+                    semis.append(depth)
+                e += 1
+            self.semis[line] = semis
+            self.depth_end[line] = depth
+
+    def run(self):
+        self.block(1, len(self.lines), 0, "", "<module>", "module")
+        return self.chunks
+
+    def item_end(self, start, hi, base):
+        """
+        last line of the item starting at line start: where the depth is back to base after a brace was opened,
+        or the first ';' at base depth (struct Unit; mod foo;)
+        """
+        opened = False
+        for line in range(start, hi + 1):
+            opened = opened or self.opens[line]
+            if self.depth_end[line] == base and (opened or base in self.semis[line]):
+                return line
+        return hi
+
+    def block(self, lo, hi, base, parent, symbol, kind):
+        cursor = lo
+        group_start = group_end = None
+        line = lo
+        while line <= hi:
+            text = self.lines.lines[line - 1]
+            m = RUST_ITEM_RE.match(text) if self.depth_start[line] == base else None
+            if m is not None:
+                if group_start is not None:
+                    self.emit_group(group_start, group_end, symbol, parent or symbol, kind)
+                    cursor, group_start = group_end + 1, None
+                end = self.item_end(line, hi, base)
+                self.item(m, line, cursor, end, base, parent)
+                cursor = line = end + 1
+                continue
+
+            if self.depth_start[line] == base and RUST_LEADING_RE.match(text):
+                line += 1  # kept for the next item, or added to the group by the next statement
+                continue
+            if group_start is not None and self.lines.chars(group_start, line) > self.max_chars:
+                self.emit_group(group_start, group_end, symbol, parent or symbol, kind)
+                cursor, group_start = group_end + 1, None
+            if group_start is None:
+                group_start = cursor
+            group_end = line
+            line += 1
+        if group_start is not None:
+            self.emit_group(group_start, group_end, symbol, parent or symbol, kind)
+
+    def emit_group(self, start, end, symbol, qualified_path, kind):
+        if self.lines.text(start, end).strip() not in ("", "}", "};"):  # closing brace of a split impl alone
+            self.emit(start, end, symbol, qualified_path, kind)
+
+    def item(self, m, line, start, end, base, parent):
+        """
+        :param m: match of RUST_ITEM_RE on the first line of the item
+        :param line: first line of the item, start <= line includes its doc comments and attributes
+        """
+        kind = m.group(1).rstrip("!")
+        if kind == "impl":
+            header = RUST_IMPL_RE.search(self.lines.text(line, min(end, line + 5)))
+            name = " ".join(header.group(1).split()) if header else "impl"
+        else:
+            name = m.group(2) or kind
+        qualified_path = parent + "::" + name if parent else name
+
+        if self.lines.chars(start, end) <= self.max_chars:
+            self.emit(start, end, name, qualified_path, kind)
+        elif kind in ("impl", "trait", "mod"):
+            # header in a first chunk then one chunk per member
+            self.block(start, end, base + 1, qualified_path, name, kind)
+        else:
+            boundaries = [b for b in range(start, end) if self.depth_end[b] == base + 1
+                          and self.lines.lines[b - 1].rstrip().endswith((";", "}"))]
+            self.emit(start, end, name, qualified_path, kind, boundaries=boundaries)
+
+
+def language_of(path):
+    if path.endswith(".py"):
+        return "python"
+    if path.endswith(".rs"):
+        return "rust"
+    return None
+
+
+def chunk_code(text, language, max_chars=MAX_CHUNK_CHARS):
+    """
+    :param text: source of one file
+    :param language: "python" or "rust"
+    :param max_chars: max size of a chunk, longer definitions are split
+    :return: list of dicts with text, symbol, qualified_path, kind, start_line, end_line and part
+    :raises SyntaxError: when a Python file cannot be parsed
+    """
+    chunker = _PythonChunker if language == "python" else _RustChunker
+    return chunker(text, max_chars).run()
+
+
+def chunk_documents(docs, max_chars=MAX_CHUNK_CHARS, fallback=None):
+    """
+    Chunk whole-file documents
+    :param docs: documents, one per source file, with a source in their metadata
+    :param max_chars: max size of a chunk
+    :param fallback: function taking a list with one document and returning its chunks, used for files of
+                     another language or that cannot be parsed - they are dropped when None
+    :return: list of chunk documents
+    """
+    chunks = []
+    for doc in docs:
+        source = doc.metadata.get("source", "")
+        language = language_of(source)
+        try:
+            if language is None:
+                raise ValueError(f"no structural chunker for {source}")
+            parts = chunk_code(doc.page_content, language, max_chars=max_chars)
+        except (SyntaxError, ValueError) as e:
+            print(f"Structural chunking failed for {source}: {e}")
+            if fallback is not None:
+                chunks.extend(fallback([doc]))
+            continue
+        for part in parts:
+            metadata = dict(doc.metadata, language=language)
+            metadata.update((key, part[key]) for key in
+                            ("symbol", "qualified_path", "kind", "start_line", "end_line", "part"))
+            chunks.append(Document(page_content=part["text"], metadata=metadata))
+    return chunks
+
+
+def benchmark_chunkers(paths, max_chars=MAX_CHUNK_CHARS, chunk_size=1024, chunk_overlap=128):
+    """
+    Throughput and chunk statistics of chunk_code() against RecursiveCharacterTextSplitter.from_language
+    :param paths: .py and .rs files
+    :return: dict chunker name -> {"chunks", "avg_chars", "max_chars", "mb_per_s"}
+    """
+    from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+
+    sources = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            sources.append((language_of(path), f.read()))
+    mb = sum(len(text) for _, text in sources) / 1e6
+    splitters = {
+        "python": RecursiveCharacterTextSplitter.from_language(Language.PYTHON, chunk_size=chunk_size,
+                                                               chunk_overlap=chunk_overlap),
+        "rust": RecursiveCharacterTextSplitter.from_language(Language.RUST, chunk_size=chunk_size,
+                                                             chunk_overlap=chunk_overlap),
+    }
+
+    def structural(language, text):
+        try:
+            return [c["text"] for c in chunk_code(text, language, max_chars=max_chars)]
+        except SyntaxError:
+            return []
+
+    report = {}
+    for name, chunk_fn in (("structural", structural),
+                           ("splitter", lambda language, text: splitters[language].split_text(text))):
+        t1 = time.perf_counter()
+        chunks = [chunk for language, text in sources for chunk in chunk_fn(language, text)]
+        elapsed = time.perf_counter() - t1
+        sizes = [len(chunk) for chunk in chunks] or [0]
+        report[name] = {"chunks": len(chunks), "avg_chars": sum(sizes) / len(sizes), "max_chars": max(sizes),
+                        "mb_per_s": mb / elapsed if elapsed else float("inf")}
+        print(f"{name:>10}: {len(chunks):6d} chunks, avg {report[name]['avg_chars']:.0f} chars, "
+              f"max {report[name]['max_chars']} chars, {report[name]['mb_per_s']:.2f} MB/s")
+    return report
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    files = sorted(glob.glob(os.path.join(root, "**", "*.py"), recursive=True) +
+                   glob.glob(os.path.join(root, "**", "*.rs"), recursive=True))
+    print(f"{len(files)} files under {root}")
+    benchmark_chunkers(files)
@@ -0,0 +1,116 @@
+"""
+Context assembly for the RAG prompt, replaces the format_docs() string concatenation.
+The retrieved chunks (best first) go through three steps before they are placed in the prompt:
+1. near-duplicates (same text ingested twice, chunks that contain each other) are dropped
+2. chunks of the same source that overlap - consecutive chunks share chunk_overlap characters - are merged
+3. the pieces are packed by relevance until the token budget of the target model is used
+The context is built with a single join and nothing is printed.
+"""
+import os
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))  # tokens given to the retrieved context
+CHARS_PER_TOKEN = 4  # rough estimate used when no tokenizer is given
+DUPLICATE_THRESHOLD = 0.8  # Jaccard similarity of the word shingles above which two chunks are duplicates
+MIN_OVERLAP = 20  # min number of shared characters to merge two chunks of the same source
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def shingles(text, n=5):
+    words = text.split()
+    if len(words) <= n:
+        return {hash(" ".join(words))}
+    return {hash(" ".join(words[i:i + n])) for i in range(len(words) - n + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def merge_overlap(first, second, min_overlap=MIN_OVERLAP):
+    """
+    :return: first followed by second without the part they share, when second starts with the end of first,
+             else None
+    """
+    probe = second[:min_overlap]
+    if len(probe) < min_overlap:
+        return None
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first[:start] + second
+        start = first.find(probe, start + 1)
+    return None
+
+
+def dedupe(docs, threshold=DUPLICATE_THRESHOLD):
+    """
+    drop the chunks that are contained in, or nearly identical to, a more relevant chunk
+    :param docs: documents, best first
+    :return: list of (document, shingles) kept, best first
+    """
+    kept = []
+    for doc in docs:
+        text = doc.page_content
+        doc_shingles = shingles(text)
+        if any(text in other.page_content or jaccard(doc_shingles, other_shingles) >= threshold
+               for other, other_shingles in kept):
+            continue
+        kept.append((doc, doc_shingles))
+    return kept
+
+
+def merge_adjacent(docs):
+    """
+    merge the overlapping chunks of a source into one piece, a piece keeps the rank of its best chunk
+    :param docs: documents, best first
+    :return: list of pieces {"text", "source", "metadata"}, best first
+    """
+    pieces = []
+    for doc in docs:
+        source = doc.metadata.get("source")
+        text = doc.page_content
+        for piece in pieces:
+            if source is None or piece["source"] != source:
+                continue
+            merged = merge_overlap(piece["text"], text) or merge_overlap(text, piece["text"])
+            if merged is not None:
+                piece["text"] = merged
+                break
+        else:
+            pieces.append({"text": text, "source": source, "metadata": doc.metadata})
+    return pieces
+
+
+def pack_context(docs, token_budget=CONTEXT_TOKEN_BUDGET, count_tokens=estimate_tokens, format_piece=None,
+                 separator="\n\n"):
+    """
+    :param docs: retrieved documents, best first
+    :param token_budget: max number of tokens of the context
+    :param count_tokens: function returning the number of tokens of a string, e.g. from the model tokenizer
+    :param format_piece: function taking a piece {"text", "source", "metadata"} and returning the string placed in
+                         the prompt, defaults to the text
+    :param separator: string placed between the pieces
+    :return: context string
+    """
+    if format_piece is None:
+        format_piece = lambda piece: piece["text"]
+
+    pieces = merge_adjacent([doc for doc, _ in dedupe(docs)])
+
+    parts = []
+    used = 0
+    for piece in pieces:
+        part = format_piece(piece)
+        cost = count_tokens(part) + count_tokens(separator)
+        if used + cost <= token_budget:
+            parts.append(part)
+            used += cost
+        elif not parts:  # the best piece alone is over budget, keep its beginning rather than nothing
+            parts.append(format_piece(dict(piece, text=piece["text"][:token_budget * CHARS_PER_TOKEN])))
+            break
+    return separator.join(parts)
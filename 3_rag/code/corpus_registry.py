@@ -0,0 +1,189 @@
+"""
+Corpus registry - one shared, deduplicated Chroma store for all the CONTENT_IDs (annual_reports, code,
+langgraph_docs, langchain_ai_docs, ...) instead of one store per CONTENT_ID with its path hardcoded in every
+ingest / model module.
+- the id of a chunk in the shared store is the hash of its text: a chunk ingested for several CONTENT_IDs is stored
+  and embedded once
+- the membership of a chunk in a collection is a boolean metadata flag "cid_<CONTENT_ID>", adding an existing chunk
+  to another collection only updates its metadata
+- a query searches any set of collections in a single pass with a metadata filter on the flags
+The metadata (source, ...) of a deduplicated chunk is the one of its first ingestion.
+"""
+import os
+
+from core.rag_agents.ingest_manifest import text_hash
+from core.rag_agents.ann_index import iter_chroma_pages
+from core.rag_agents.embedding_models import EMBEDDINGS_MODEL
+from core.rag_agents.rag_resources import registry, get_vectordb
+
+VECTOR_STORES_PATH = "vector_stores"
+SHARED_DB_PATH = os.environ.get("SHARED_DB_PATH", os.path.join(VECTOR_STORES_PATH, "db_chroma_shared"))
+ADD_BATCH_SIZE = 256
+
+# CONTENT_ID -> description, all the collections of the shared store use EMBEDDINGS_MODEL
+CORPORA = {
+    "annual_reports": "annual report PDFs (ingest.py)",
+    "code": "nanochat Python and Rust sources (ingest_code.py)",
+    "langgraph_docs": "LangGraph documentation (ingest_md.py)",
+    "langchain_ai_docs": "LangChain documentation (ingest_md.py)",
+}
+
+
+def store_path(content_id):
+    """
+    path of the dedicated (legacy) Chroma store of a CONTENT_ID
+    """
+    return os.path.join(VECTOR_STORES_PATH, "db_chroma_" + content_id)
+
+
+def member_key(content_id):
+    return "cid_" + content_id
+
+
+def collections_filter(content_ids):
+    """
+    Chroma where filter matching the chunks of any of the given collections
+    """
+    clauses = [{member_key(content_id): True} for content_id in content_ids]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+class CorpusRegistry:
+    def __init__(self, db_path=SHARED_DB_PATH, model_name=EMBEDDINGS_MODEL, device=None, embeddings=None):
+        """
+        :param db_path: persist directory of the shared store
+        :param model_name: embedding model of every collection
+        :param device: device of the embedding model, None to pick the best available
+        :param embeddings: embedding model used to ingest, defaults to the one of the store
+        """
+        self.db_path = db_path
+        self.model_name = model_name
+        self.device = device
+        self._embeddings = embeddings
+
+    @property
+    def embeddings(self):
+        return self._embeddings or self.vectordb.embeddings
+
+    @property
+    def vectordb(self):
+        return get_vectordb(self.db_path, self.model_name, self.device, backend="chroma")
+
+    def add_chunks(self, content_id, chunks, vectors=None):
+        """
+        Add chunks to a collection, chunks already in the store from any collection are only linked to it
+        :param content_id: collection, e.g. "code"
+        :param chunks: documents
+        :param vectors: their embeddings when already computed (e.g. copied from another store), None to embed
+        :return: dict with the number of chunks added (embedded) and linked (already stored)
+        """
+        if content_id not in CORPORA:
+            print("Unregistered CONTENT_ID, add it to CORPORA: ", content_id)
+        collection = self.vectordb._collection
+        key = member_key(content_id)
+        report = {"added": 0, "linked": 0}
+
+        for start in range(0, len(chunks), ADD_BATCH_SIZE):
+            batch = {}  # id -> (chunk, position in the input), duplicates inside the batch are dropped
+            for i, chunk in enumerate(chunks[start:start + ADD_BATCH_SIZE], start):
+                batch.setdefault(text_hash(chunk.page_content)[:32], (chunk, i))
+
+            # 1. chunks already stored: set the membership flag, no embedding
+            existing = collection.get(ids=list(batch), include=["metadatas"])
+            linked = [(doc_id, meta) for doc_id, meta in zip(existing["ids"], existing["metadatas"])
+                      if not (meta or {}).get(key)]
+            if linked:
+                collection.update(ids=[doc_id for doc_id, _ in linked],
+                                  metadatas=[dict(meta or {}, **{key: True}) for _, meta in linked])
+            report["linked"] += len(existing["ids"])
+
+            # 2. new chunks: embed once and store with the flag
+            stored = set(existing["ids"])
+            new_ids = [doc_id for doc_id in batch if doc_id not in stored]
+            if not new_ids:
+                continue
+            new_chunks = [batch[doc_id][0] for doc_id in new_ids]
+            if vectors is None:
+                new_vectors = self.embeddings.embed_documents([chunk.page_content for chunk in new_chunks])
+            else:
+                new_vectors = [vectors[batch[doc_id][1]] for doc_id in new_ids]
+            collection.add(ids=new_ids, embeddings=new_vectors, documents=[c.page_content for c in new_chunks],
+                           metadatas=[dict(c.metadata, **{key: True}) for c in new_chunks])
+            report["added"] += len(new_ids)
+
+        print(f"Collection {content_id}: {report['added']} chunks added, {report['linked']} already stored")
+        return report
+
+    def remove_collection(self, content_id, page_size=1024):
+        """
+        Unlink every chunk from a collection, chunks that no longer belong to any collection are deleted
+        :return: number of chunks deleted from the store
+        """
+        collection = self.vectordb._collection
+        key = member_key(content_id)
+        deleted = 0
+        while True:
+            page = collection.get(where={key: True}, limit=page_size, include=["metadatas"])
+            if not page["ids"]:
+                return deleted
+            orphans = [doc_id for doc_id, meta in zip(page["ids"], page["metadatas"])
+                       if not any(v is True for k, v in meta.items() if k.startswith("cid_") and k != key)]
+            kept = [(doc_id, meta) for doc_id, meta in zip(page["ids"], page["metadatas"]) if doc_id not in orphans]
+            if orphans:
+                collection.delete(ids=orphans)
+                deleted += len(orphans)
+            if kept:
+                collection.update(ids=[doc_id for doc_id, _ in kept],
+                                  metadatas=[dict(meta, **{key: False}) for _, meta in kept])
+
+    def count(self, content_id):
+        return len(self.vectordb._collection.get(where={member_key(content_id): True}, include=[])["ids"])
+
+    def import_store(self, content_id, db_path=None):
+        """
+        Copy a dedicated Chroma store into the shared one, the stored embeddings are reused
+        :param content_id: collection to fill
+        :param db_path: store to copy, defaults to store_path(content_id)
+        """
+        from langchain_core.documents import Document
+
+        _, pages = iter_chroma_pages(db_path or store_path(content_id))
+        report = {"added": 0, "linked": 0}
+        for vectors, _, documents, metadatas in pages:
+            chunks = [Document(page_content=text, metadata=meta or {}) for text, meta in zip(documents, metadatas)]
+            for name, n in self.add_chunks(content_id, chunks, vectors=vectors).items():
+                report[name] += n
+        return report
+
+    def search(self, query, content_ids, k=8):
+        """
+        similarity search over one or more collections in a single query
+        :param query: query text
+        :param content_ids: list of CONTENT_IDs
+        :param k: number of results over all the collections
+        :return: list of documents
+        """
+        return self.vectordb.similarity_search(query, k=k, filter=collections_filter(content_ids))
+
+    def search_by_vector(self, query_vector, content_ids, k=8):
+        return self.vectordb.similarity_search_by_vector(query_vector, k=k, filter=collections_filter(content_ids))
+
+    def as_retriever(self, content_ids, k=8):
+        return self.vectordb.as_retriever(search_kwargs={"k": k, "filter": collections_filter(content_ids)})
+
+
+def get_corpus_registry(db_path=SHARED_DB_PATH, model_name=EMBEDDINGS_MODEL, device=None):
+    """
+    the registry of this process for the shared store at db_path
+    """
+    return registry.get(("corpus_registry", db_path, model_name, device),
+                        lambda: CorpusRegistry(db_path, model_name, device))
+
+
+if __name__ == '__main__':
+    # move the dedicated stores that exist into the shared store
+    corpus = get_corpus_registry()
+    for cid in CORPORA:
+        if os.path.exists(store_path(cid)):
+            print(cid, corpus.import_store(cid))
+    print(corpus.search("How do I add memory to a LangGraph agent?", ["langgraph_docs", "langchain_ai_docs"], k=4))
@@ -0,0 +1,103 @@
+"""
+CPU optimised embedding backend for the ingest workers that have no GPU.
+The default HuggingFaceEmbeddings encodes with a fixed batch size, so a batch of short chunks is processed with
+the same small batch as the longest chunks and most of the compute is spent on padding tokens.
+Here the chunks are grouped in length buckets and each bucket gets its own batch size from a token budget,
+the torch thread count is pinned and the linear layers can optionally be quantized to int8.
+"""
+import os
+import time
+
+import torch
+from sentence_transformers import SentenceTransformer
+from langchain_core.embeddings import Embeddings
+
+from core.rag_agents.device_config import EMBEDDING_THREADS
+
+EMBEDDING_INT8 = os.environ.get("EMBEDDING_INT8", "0") == "1"
+
+# upper bound (in tokens) of every length bucket, the last bucket takes everything up to max_seq_length
+BUCKET_EDGES = (32, 64, 128, 256, 384, 512)
+
+
+class BucketedCPUEmbeddings(Embeddings):
+    """
+    Embeddings on CPU with length bucketing and an adaptive batch size per bucket
+    """
+
+    def __init__(self, model_name, num_threads=EMBEDDING_THREADS, quantize=EMBEDDING_INT8, max_batch_tokens=16384,
+                 max_batch_size=256, trust_remote_code=False):
+        """
+        :param model_name: sentence transformers model name
+        :param num_threads: number of intra-op threads used by torch
+        :param quantize: apply int8 dynamic quantization to the linear layers - faster, slightly different vectors
+        :param max_batch_tokens: padded token budget of one batch, batch size = max_batch_tokens / bucket length
+        :param max_batch_size: upper bound on the batch size for the buckets of very short chunks
+        :param trust_remote_code: needed by models that ship custom code
+        """
+        torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device="cpu", trust_remote_code=trust_remote_code)
+        self.model.eval()
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self.num_threads = num_threads
+        self.quantize = quantize
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_seq_length = self.model.max_seq_length
+        self.stats = {"chunks": 0, "seconds": 0.0}
+
+    def _token_lengths(self, texts):
+        encoded = self.model.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def make_batches(self, texts):
+        """
+        Group the indices of texts in length buckets and split every bucket in batches sized by the token budget
+        :param texts: list of strings
+        :return: list of lists of indices into texts
+        """
+        edges = [e for e in BUCKET_EDGES if e < self.max_seq_length] + [self.max_seq_length]
+        buckets = {edge: [] for edge in edges}
+        for i, length in enumerate(self._token_lengths(texts)):
+            edge = next(e for e in edges if length <= e or e == edges[-1])
+            buckets[edge].append(i)
+
+        batches = []
+        for edge, indices in buckets.items():
+            batch_size = max(1, min(self.max_batch_size, self.max_batch_tokens // edge))
+            batches.extend(indices[i: i + batch_size] for i in range(0, len(indices), batch_size))
+        return batches
+
+    def embed_documents(self, texts):
+        t1 = time.time()
+        vectors = [None] * len(texts)
+        with torch.inference_mode():
+            for batch in self.make_batches(texts):
+                encoded = self.model.encode([texts[i] for i in batch], batch_size=len(batch), convert_to_numpy=True)
+                for i, vector in zip(batch, encoded):
+                    vectors[i] = vector.tolist()
+
+        elapsed = time.time() - t1
+        self.stats["chunks"] += len(texts)
+        self.stats["seconds"] += elapsed
+        print(f"Embedded {len(texts)} chunks in {elapsed:.2f}s ({self.chunks_per_second(len(texts), elapsed):.1f} "
+              f"chunks/s), overall {self.chunks_per_second():.1f} chunks/s")
+        return vectors
+
+    def embed_query(self, text):
+        with torch.inference_mode():
+            return self.model.encode([text], convert_to_numpy=True)[0].tolist()
+
+    def embed_queries(self, texts):
+        """
+        embed_query() of several queries in one forward pass, used by batch_retrieval
+        """
+        with torch.inference_mode():
+            return self.model.encode(list(texts), convert_to_numpy=True).tolist()
+
+    def chunks_per_second(self, chunks=None, seconds=None):
+        if chunks is None:
+            chunks, seconds = self.stats["chunks"], self.stats["seconds"]
+        return chunks / seconds if seconds else 0.0
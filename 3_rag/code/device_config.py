@@ -0,0 +1,76 @@
+"""
+Device resolution for the embedding models and retrievers.
+Instead of a hardcoded device = "cuda" / "mps" per module, every embedding constructor asks resolve_device(),
+which probes the accelerators present on the node and falls back to a tuned CPU setup when there is none.
+The choice can be forced with the EMBEDDINGS_DEVICE environment variable.
+"""
+import os
+from functools import lru_cache
+
+import torch
+
+EMBEDDINGS_DEVICE = os.environ.get("EMBEDDINGS_DEVICE")  # "cuda", "mps" or "cpu", None to probe
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", os.cpu_count() or 1))
+
+
+def device_available(device):
+    if device.startswith("cuda"):
+        return torch.cuda.is_available()
+    if device == "mps":
+        return torch.backends.mps.is_available()
+    return device == "cpu"
+
+
+def configure_cpu(num_threads=EMBEDDING_THREADS):
+    """
+    Pin the torch thread pools for CPU inference: one intra-op thread per core and a single inter-op thread,
+    the embedding forward pass has no inter-op parallelism to exploit.
+    """
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # can only be set once, before any parallel work has started
+        pass
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+@lru_cache(maxsize=None)
+def resolve_device(preferred=None):
+    """
+    Pick the device for the embedding models
+    :param preferred: device requested by the caller, defaults to EMBEDDINGS_DEVICE, used only if available
+    :return: "cuda", "mps" or "cpu"
+    """
+    preferred = preferred or EMBEDDINGS_DEVICE
+    if preferred:
+        if device_available(preferred):
+            device = preferred
+        else:
+            print(f"Device {preferred} is not available on this node, probing for another one")
+            preferred = None
+
+    if not preferred:
+        if torch.cuda.is_available():
+            device = "cuda"
+        elif torch.backends.mps.is_available():
+            device = "mps"
+        else:
+            device = "cpu"
+
+    if device == "cpu":
+        configure_cpu()
+    print("Embeddings device: ", get_device_settings(device))
+    return device
+
+
+def get_device_settings(device=None):
+    """
+    :param device: device to describe, defaults to the one chosen by resolve_device()
+    :return: dict with the chosen device and the thread settings
+    """
+    if device is None:
+        device = resolve_device()
+    settings = {"device": device, "threads": torch.get_num_threads(), "interop_threads": torch.get_num_interop_threads()}
+    if device.startswith("cuda"):
+        settings["gpu"] = torch.cuda.get_device_name(0)
+    return settings
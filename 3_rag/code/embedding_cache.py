@@ -0,0 +1,178 @@
+"""
+Persistent embedding cache shared by all the ingest scripts.
+Vectors are keyed by (embedding model, sha256 of the text) and stored as float16 in a SQLite file, so the same
+chunk indexed under several CONTENT_IDs (or overlapping LangGraph / LangChain docs) is embedded only once.
+The cache is bounded in size, the least recently used vectors are evicted first.
+Vectors come back float16-rounded (relative error ~1e-3): they differ slightly from the output of the model without
+the cache, CachedEmbeddings returns the rounded values for the misses too so that a text always gets the same vector.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "vector_stores/embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 4 * 1024 ** 3))  # 4 GB
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite store of float16 vectors with LRU eviction once the total size of the vectors exceeds max_bytes.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, keys):
+        """
+        :param model: embedding model name
+        :param keys: list of text hashes
+        :return: dict of text hash -> float32 numpy vector for the keys found in the cache
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):  # stay below the SQLite limit on query parameters
+                part = keys[i: i + 500]
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})", [model, *part]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                      [(now, model, key) for key in found])
+                self.conn.commit()
+        return found
+
+    def put_many(self, model, items):
+        """
+        :param model: embedding model name
+        :param items: dict of text hash -> vector
+        :return: None
+        """
+        now = time.time()
+        rows = [(model, key, np.asarray(vector, dtype=np.float16).tobytes(), now) for key, vector in items.items()]
+        with self.lock:
+            # a replaced row only changes the size by the difference with the vector it replaces
+            replaced = self._sizes(model, [row[1] for row in rows])
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self.size += sum(len(row[2]) - replaced.get(row[1], 0) for row in rows)
+            if self.size > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _sizes(self, model, keys):
+        """
+        :return: dict of text hash -> size of the stored vector, for the keys present in the cache
+        """
+        sizes = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i: i + 500]
+            sizes.update(self.conn.execute(
+                f"SELECT text_hash, LENGTH(vector) FROM embeddings WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(part))})", [model, *part]
+            ))
+        return sizes
+
+    def _evict(self):
+        # recompute the size, other processes may have written to the same file
+        self.size = self.conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        target = int(self.max_bytes * 0.9)  # evict a bit more than needed so that eviction does not run every put
+        # walk the rows from the least recently used one without loading them all, count how many must go
+        count = 0
+        for (size,) in self.conn.execute("SELECT LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if self.size <= target:
+                break
+            self.size -= size
+            count += 1
+        self.conn.execute("DELETE FROM embeddings WHERE rowid IN "
+                          "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (count,))
+        print(f"Embedding cache: evicted {count} vectors")
+
+    def close(self):
+        self.conn.close()
+
+
+_shared_cache = None
+
+
+def get_embedding_cache():
+    """
+    the cache instance shared by all the embedding models of this process
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = EmbeddingCache()
+    return _shared_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in Embeddings wrapper: texts found in the cache skip the model forward pass entirely, only the misses
+    are sent to the wrapped model (in a single call) and then stored in the cache. All the vectors returned are
+    float16-rounded, see the module docstring.
+    """
+
+    def __init__(self, embeddings, model_name, cache=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, texts, namespace, embed_fn):
+        keys = [text_key(text) for text in texts]
+        found = self.cache.get_many(namespace, list(set(keys)))
+
+        # embed every distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(namespace, computed)
+            # return the float16 rounded values for the misses as well, the same text always gets the same vector
+            for key, vector in computed.items():
+                found[key] = np.asarray(vector, dtype=np.float16).astype(np.float32)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return [found[key].tolist() for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, self.model_name, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        # queries may be encoded differently than documents, keep them in a separate namespace
+        return self._embed([text], self.model_name + ":query",
+                           lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts):
+        # the misses of a batch of queries are embedded in one call
+        embed_fn = getattr(self.embeddings, "embed_queries", None) or self.embeddings.embed_documents
+        return self._embed(list(texts), self.model_name + ":query", embed_fn)
@@ -0,0 +1,40 @@
+"""
+Construction of the embedding models used by the ingest scripts, in one place instead of a copy per ingest module.
+"""
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from core.rag_agents.embedding_cache import CachedEmbeddings
+from core.rag_agents.cpu_embeddings import BucketedCPUEmbeddings
+from core.rag_agents.device_config import resolve_device
+
+EMBEDDINGS_MODEL = "thenlper/gte-large"
+
+
+def build_embeddings_model(model_name=None, device=None, trust_remote_code=False, use_cache=True, cpu_engine=True):
+    """
+    Create the HuggingFace embedding model, wrapped by the persistent embedding cache
+    :param model_name: sentence transformers model name, defaults to EMBEDDINGS_MODEL
+    :param device: "cuda", "mps" or "cpu", None picks the best device available on this node
+    :param trust_remote_code: needed by models that ship custom code, e.g. NV-Embed or jina embeddings
+    :param use_cache: when True, vectors already computed for the same (model, text) are read from the cache
+    :param cpu_engine: on "cpu", use the length bucketed BucketedCPUEmbeddings instead of HuggingFaceEmbeddings
+    :return: Langchain Embeddings instance
+    """
+    if model_name is None:
+        model_name = EMBEDDINGS_MODEL
+    device = resolve_device(device)
+
+    cache_key = model_name
+    if device == "cpu" and cpu_engine:
+        embeddings_model = BucketedCPUEmbeddings(model_name, trust_remote_code=trust_remote_code)
+        if embeddings_model.quantize:  # int8 vectors differ slightly, never mix them with the full precision ones
+            cache_key += ":int8"
+    else:
+        model_kwargs = {"device": device}
+        if trust_remote_code:
+            model_kwargs["trust_remote_code"] = True
+        embeddings_model = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs)
+
+    if use_cache:
+        embeddings_model = CachedEmbeddings(embeddings_model, cache_key)
+    return embeddings_model
@@ -5,44 +5,86 @@ Naive RAG - Implementation Example
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
+from langchain_community.document_loaders import PyPDFLoader
 from traceback import print_exc
+from functools import partial
+
+from core.rag_agents.ingest_manifest import MANIFEST_NAME, load_manifest, save_manifest, diff_files, make_chunk_ids, \
+    build_manifest
+from core.rag_agents.parallel_ingest import INGEST_WORKERS, parallel_map, batched, flatten, chunk_batch_size
+from core.rag_agents.streaming_ingest import run_streaming_ingest, tag_chunk_ids, purge_sources
+from core.rag_agents.embedding_models import build_embeddings_model
+from core.rag_agents.device_config import resolve_device
+from core.rag_agents.ann_index import IVFVectorStore, ann_path
+from core.rag_agents.corpus_registry import store_path, get_corpus_registry
+
+import os
+import glob
 
 
 DATA_PATH = r"C:\home\ananth\research\my_projects\agentic_ai_dec2025_2026\core\rag_agents\dataset"
-DB_CHROMA_PATH = "vector_stores/db_chroma_annual_reports"
+CONTENT_ID = "annual_reports"
+DB_CHROMA_PATH = store_path(CONTENT_ID)
 EMBEDDINGS_MODEL = "thenlper/gte-large"
+MANIFEST_PATH = os.path.join(DB_CHROMA_PATH, MANIFEST_NAME)
+
+
+def get_source_files():
+    """
+    list the PDF files under DATA_PATH, same selection as the DirectoryLoader used by get_docs()
+    :return: sorted list of file paths
+    """
+    return sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.pdf"), recursive=True))
+
+
+def load_pdf(path):
+    """
+    parse a single PDF file, one document per page. Runs in a worker process when loading in parallel.
+    :param path: PDF file path
+    :return: list of documents
+    """
+    return PyPDFLoader(path).load()
 
 
-def get_docs():
+def get_docs(paths=None, workers=INGEST_WORKERS):
     """
     loads the documents from the given source where each doc has page_content and metadata.
     It is possible to add metadata by updating the doc.metadata which is a dict()
+    :param paths: optional list of PDF files to load, when None all the files under DATA_PATH are loaded
+    :param workers: number of processes parsing the PDF files, a file that fails to parse is reported and skipped
     :return:
     """
-    loader = DirectoryLoader(DATA_PATH, glob="*.pdf", loader_cls=PyPDFLoader, recursive=True)
-    docs = loader.load()
-    return docs
+    if paths is None:
+        paths = get_source_files()
+    results, _ = parallel_map(load_pdf, paths, workers=workers, label="file")
+    return flatten(results)
+
 
+def split_batch(docs, chunk_size, chunk_overlap):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(docs)
 
-def get_chunks(docs, chunk_size=512, chunk_overlap=50):
+
+def get_chunks(docs, chunk_size=512, chunk_overlap=50, workers=INGEST_WORKERS):
     """
     Given docs obtained by using LangChain loader, split these to chunks and return them
     :param docs: documents returned by loader, that could be ArxivLoader or local directory loader
     :param chunk_size: size of chunk to be set according to the application
     :param chunk_overlap: overlap window size between consecutive chunks
+    :param workers: number of processes used for splitting, chunks are returned in the order of docs
     :return: chunks
     """
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    texts = text_splitter.split_documents(docs)
+    split_fn = partial(split_batch, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    results, _ = parallel_map(split_fn, batched(docs, chunk_batch_size(len(docs), workers)),
+                              workers=workers, label="batch")
+    texts = flatten(results)
     return texts  # chunked docs
 
 
-def get_embeddings_model(model_name=None, device="cuda"):
+def get_embeddings_model(model_name=None, device=None, use_cache=True):
     if model_name is None:
         model_name = EMBEDDINGS_MODEL
-    embeddings_model = HuggingFaceEmbeddings(model_name=model_name,model_kwargs={"device": device})
-    return embeddings_model
+    return build_embeddings_model(model_name=model_name, device=device, use_cache=use_cache)
 
 
 def create_vector_store(texts, embeddings, db_path, use_db="chroma"):
@@ -51,13 +93,17 @@ def create_vector_store(texts, embeddings, db_path, use_db="chroma"):
     :param texts: chunks for which we are constructing the data store
     :param embeddings: vector embeddings for given chunks
     :param db_path: storage path
-    :param use_db: type of data store to use
+    :param use_db: type of data store to use - "chroma", or "ivf" for the quantized ANN index of ann_index
     :return: None
     """
     flag = True
     try:
         if use_db == "chroma":
-            db = Chroma.from_documents(texts, embeddings, persist_directory=db_path)
+            ids = [t.metadata.get("chunk_id") for t in texts]
+            db = Chroma.from_documents(texts, embeddings, persist_directory=db_path, ids=ids if all(ids) else None)
+        elif use_db == "ivf":
+            db = IVFVectorStore.from_documents(texts, embeddings, persist_directory=ann_path(db_path),
+                                               ids=[t.metadata.get("chunk_id") or str(i) for i, t in enumerate(texts)])
         else:
             print("Unknown db type, exiting!")
             db = None
@@ -83,31 +129,133 @@ def ingest():
     # print(docs[0])
     # docs = get_docs(source="arxiv")
 
-    # 2. Chunk the documents
-    texts = get_chunks(docs)
+    # 2. Chunk the documents, the chunk ids are the ones of ingest_incremental()
+    texts = tag_chunk_ids(get_chunks(docs))
     print(len(docs), len(texts))
 
     # 3. get the embedding model
-    embs_model = get_embeddings_model(device="cuda")
+    embs_model = get_embeddings_model()
 
-    # 4. Use the embedding model to vectorize and save it in db
+    # 4. Use the embedding model to vectorize and save it in db, replacing the chunks of an earlier ingest.
+    # The files of the previous manifest that are gone are purged too, the new manifest no longer records them
+    sources = {t.metadata.get("source", "") for t in texts}
+    removed = set(load_manifest(MANIFEST_PATH)["files"]) - sources
+    purge_sources(Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embs_model), sources | removed)
     flag = create_vector_store(texts, embs_model, DB_CHROMA_PATH, use_db="chroma")
     if flag:
+        # the next ingest_incremental() starts from what was written here instead of re-adding every file
+        save_manifest(build_manifest(texts), MANIFEST_PATH)
         print("Vector Store Created!")
 
 
+def ingest_shared():
+    """
+    Ingest into the shared store of corpus_registry, chunks already stored for another CONTENT_ID are not embedded again
+    """
+    texts = get_chunks(get_docs())
+    return get_corpus_registry().add_chunks(CONTENT_ID, texts)
+
+
+def ingest_incremental(embeddings=None):
+    """
+    Re-ingest only what changed since the last run. A manifest stored next to the vector store records
+    the hash of every source file and of every chunk created from it:
+    - unchanged files are skipped without being loaded
+    - for new or changed files only the chunks whose text is new are embedded, stale chunks are deleted
+    - chunks of files that no longer exist under DATA_PATH are deleted from the collection
+    :param embeddings: embedding model, defaults to get_embeddings_model()
+    :return: dict with the counts of what was done and skipped
+    """
+    manifest = load_manifest(MANIFEST_PATH)
+
+    changed, unchanged, removed, hashes = diff_files(manifest, get_source_files())
+    report = {"files_unchanged": len(unchanged), "files_changed": len(changed), "files_removed": len(removed),
+              "chunks_skipped": sum(len(manifest["files"][p]["chunks"]) for p in unchanged),
+              "chunks_embedded": 0, "chunks_deleted": 0}
+
+    if embeddings is None:
+        embeddings = get_embeddings_model()
+    db = Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embeddings)
+
+    # 1. drop the chunks of the files that were removed from the data path
+    for path in removed:
+        stale_ids = list(manifest["files"][path]["chunks"])
+        if stale_ids:
+            db.delete(ids=stale_ids)
+        report["chunks_deleted"] += len(stale_ids)
+        del manifest["files"][path]
+        save_manifest(manifest, MANIFEST_PATH)
+
+    # 2. re-chunk new and changed files, embed only the chunks not already in the store
+    for path in changed:
+        try:
+            texts = get_chunks(load_pdf(path), workers=1)
+        except Exception:
+            print_exc()
+            print("Exception when loading, skipped: ", path)
+            continue
+
+        if path not in manifest["files"]:
+            # chunks written without a manifest (e.g. by ingest_streaming) are replaced, not kept next to the new ones
+            report["chunks_deleted"] += purge_sources(db, [path])
+        old_chunks = manifest["files"].get(path, {}).get("chunks", {})
+        new_chunks = {}
+        to_add, to_add_ids = [], []
+        for text, (chunk_id, chunk_hash) in zip(texts, make_chunk_ids(texts)):
+            text.metadata["chunk_id"] = chunk_id
+            new_chunks[chunk_id] = chunk_hash
+            if chunk_id not in old_chunks:
+                to_add.append(text)
+                to_add_ids.append(chunk_id)
+
+        stale_ids = [chunk_id for chunk_id in old_chunks if chunk_id not in new_chunks]
+        if to_add:
+            db.add_documents(to_add, ids=to_add_ids)
+        if stale_ids:
+            db.delete(ids=stale_ids)
+
+        # the manifest is saved after every file, an interrupted run resumes from the last completed file
+        manifest["files"][path] = {"hash": hashes[path], "chunks": new_chunks}
+        save_manifest(manifest, MANIFEST_PATH)
+
+        report["chunks_embedded"] += len(to_add)
+        report["chunks_deleted"] += len(stale_ids)
+        report["chunks_skipped"] += len(new_chunks) - len(to_add)
+
+    print(f"Files: {report['files_changed']} new/changed, {report['files_unchanged']} unchanged (skipped), "
+          f"{report['files_removed']} removed")
+    print(f"Chunks: {report['chunks_embedded']} embedded, {report['chunks_skipped']} skipped, "
+          f"{report['chunks_deleted']} deleted")
+    return report
+
+
+def ingest_streaming(batch_size=64, workers=INGEST_WORKERS):
+    """
+    Ingest the PDF files as a stream of bounded batches instead of whole-corpus lists, memory stays flat
+    irrespective of the number of files under DATA_PATH.
+    :param batch_size: number of chunks embedded and written to the store together
+    :param workers: number of processes parsing the PDF files
+    :return: None
+    """
+    split_fn = partial(split_batch, chunk_size=512, chunk_overlap=50)
+    total = run_streaming_ingest(get_source_files(), load_pdf, split_fn, get_embeddings_model(), DB_CHROMA_PATH,
+                                 batch_size=batch_size, workers=workers)
+    print(f"Vector Store Updated with {total} chunks!")
+
+
 def get_retriever():
     """
     after texts are ingested in vectordb, get it as a retriever
     :return:
     """
     embeddings = HuggingFaceEmbeddings(model_name=EMBEDDINGS_MODEL,
-                                       model_kwargs={'device': 'cuda'})
+                                       model_kwargs={'device': resolve_device()})
     vectordb = Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embeddings)
     return vectordb.as_retriever(search_kwargs={"k": 8})
 
 
 if __name__ == '__main__':
-    ingest()
+    # ingest()  # full rebuild of the vector store
+    ingest_incremental()
 
 
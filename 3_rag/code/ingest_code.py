@@ -3,13 +3,25 @@ Naive RAG - Implementation Example
 Ingest source code - python source code
 """
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from traceback import print_exc
 
-from langchain_community.document_loaders.generic import GenericLoader
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from langchain_core.documents.base import Blob
+from langchain_community.document_loaders import TextLoader
 from langchain_community.document_loaders.parsers import LanguageParser
 from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+from functools import partial
+
+from core.rag_agents.parallel_ingest import INGEST_WORKERS, parallel_map, batched, flatten, chunk_batch_size
+from core.rag_agents.streaming_ingest import run_streaming_ingest, tag_chunk_ids, purge_sources
+from core.rag_agents.embedding_models import build_embeddings_model
+from core.rag_agents.device_config import resolve_device
+from core.rag_agents.ann_index import IVFVectorStore, ann_path
+from core.rag_agents.sparse_index import BM25Index, load_or_create
+from core.rag_agents.code_chunker import chunk_documents, MAX_CHUNK_CHARS
+from core.rag_agents.corpus_registry import store_path, get_corpus_registry
+
+import os
+import glob
 
 # OPTIONAL: read_summaries gets the dict of file name versus summary for all python file names
 # from core.summarizer.summarize_repo import read_summaries
@@ -17,37 +29,40 @@ from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
 # DATA_PATH = r"/Users/ananth/research/packages/nanochat"  # MAC path
 DATA_PATH = r"C:\home\ananth\research\packages\nanochat"  # PC laptop path
 
-# device = "mps"  # for MAC
-device = "cuda"  # for PC and laptop
+device = resolve_device()  # "cuda", "mps" or "cpu" - set EMBEDDINGS_DEVICE to force one
 
 CONTENT_ID = "code"
-DB_CHROMA_PATH = "vector_stores/db_chroma" + "_" + CONTENT_ID
+DB_CHROMA_PATH = store_path(CONTENT_ID)
 EMBEDDINGS_MODEL = "thenlper/gte-large"
+SPARSE_INDEX_PATH = os.path.join(DB_CHROMA_PATH, "bm25_index.pkl")  # BM25 index over the same chunk ids
+CODE_CHUNKER = os.environ.get("CODE_CHUNKER", "ast")  # "ast": one chunk per definition (code_chunker), "splitter"
 # EMBEDDINGS_MODEL = "nvidia/NV-Embed-v2"
 # EMBEDDINGS_MODEL = "jinaai/jina-embeddings-v4"  # more recent and multimodal
 
 
-def get_docs():
-    # Python files - Python Language Parser gives more granularity like functions_classes, etc
-    py_loader = GenericLoader.from_filesystem(
-        DATA_PATH,
-        glob="**/*.py",
-        parser=LanguageParser(language="python"),
-    )
+def load_code_file(path):
+    """
+    Parse one source file, runs in a worker process when loading in parallel.
+    :param path: path of a .py or .rs file
+    :return: list of documents
+    """
+    if path.endswith(".py") and CODE_CHUNKER == "splitter":
+        # Python files - Python Language Parser gives more granularity like functions_classes, etc
+        return list(LanguageParser(language="python").lazy_parse(Blob.from_path(path)))
 
-    # Load Rust files with simple TextLoader (no LanguageParser) - doesn't have AST granularity
-    rs_loader = DirectoryLoader(
-        DATA_PATH,
-        glob="**/*.rs",
-        loader_cls=TextLoader,
-    )
+    # Rust files, and Python files for the structural chunker which parses the whole file itself
+    return TextLoader(path).load()
+
+
+def get_docs(workers=INGEST_WORKERS):
+    py_paths = sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.py"), recursive=True))
+    rs_paths = sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.rs"), recursive=True))
 
-    # Load both
-    python_docs = py_loader.load()
-    rust_docs = rs_loader.load()
+    # Load both - python files first then rust files, a file that fails to parse is reported and skipped
+    results, _ = parallel_map(load_code_file, py_paths + rs_paths, workers=workers, label="file")
 
     # Merge results
-    docs = python_docs + rust_docs
+    docs = flatten(results)
 
     # -------------------------------------- OPTIONAL STEPS ------------------------------------------------
     # # update the metadata with summary for each document object
@@ -61,28 +76,30 @@ def get_docs():
     return docs
 
 
-def get_chunks(docs, chunk_size=1024, chunk_overlap=128):
+LANGUAGES = {'python': Language.PYTHON, 'rust': Language.RUST}
+
+
+def split_batch(docs, lang, chunk_size, chunk_overlap):
+    # Create language-specific splitter
+    splitter = RecursiveCharacterTextSplitter.from_language(
+        language=LANGUAGES[lang],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    return splitter.split_documents(docs)
+
+
+def get_chunks(docs, chunk_size=1024, chunk_overlap=128, workers=INGEST_WORKERS, chunker=CODE_CHUNKER):
     """
     Split documents by language, applying language-specific chunking strategies.
     :param docs: documents returned by loaders (Python + Rust files)
-    :param chunk_size: size of each chunk in characters
-    :param chunk_overlap: overlap between chunks in characters
+    :param chunk_size: size of each chunk in characters for the splitter
+    :param chunk_overlap: overlap between chunks in characters for the splitter
+    :param workers: number of processes used for splitting, chunks keep the order of docs
+    :param chunker: "ast" for one chunk per function / class / impl block with symbol metadata (code_chunker),
+                    files that cannot be parsed fall back to the splitter - "splitter" for the splitter only
     :return: list of chunked documents with metadata
     """
-    # Create language-specific splitters
-    splitters = {
-        'python': RecursiveCharacterTextSplitter.from_language(
-            language=Language.PYTHON,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        ),
-        'rust': RecursiveCharacterTextSplitter.from_language(
-            language=Language.RUST,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        ),
-    }
-
     # Separate documents by file extension
     docs_by_language = {'python': [], 'rust': []}
     for doc in docs:
@@ -100,13 +117,16 @@ def get_chunks(docs, chunk_size=1024, chunk_overlap=128):
         if not batch_docs:
             continue
 
-        splitter = splitters[lang]
-        chunks = splitter.split_documents(batch_docs)
+        split_fn = partial(split_batch, lang=lang, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        if chunker == "ast":
+            split_fn = partial(chunk_documents, max_chars=MAX_CHUNK_CHARS, fallback=split_fn)
+        results, _ = parallel_map(split_fn, batched(batch_docs, chunk_batch_size(len(batch_docs), workers)),
+                                  workers=workers, label="batch")
+        chunks = flatten(results)
 
-        # Add metadata: preserve filename, chunk index, and language
-        for i, chunk in enumerate(chunks):
-            if 'source' in chunk.metadata:
-                chunk.metadata['chunk_id'] = f"{chunk.metadata['source']}_{i}"
+        # Add metadata: deterministic chunk id (same ids as ingest_streaming) and language
+        tag_chunk_ids(chunks)
+        for chunk in chunks:
             chunk.metadata['language'] = lang
 
         all_chunks.extend(chunks)
@@ -141,12 +161,10 @@ def get_chunks(docs, chunk_size=1024, chunk_overlap=128):
     return all_chunks
 
 
-def get_embeddings_model(model_name=None, device=device):
+def get_embeddings_model(model_name=None, device=device, use_cache=True):
     if model_name is None:
         model_name = EMBEDDINGS_MODEL
-    embeddings_model = HuggingFaceEmbeddings(model_name=model_name,
-                                       model_kwargs={"device": device, "trust_remote_code": True})
-    return embeddings_model
+    return build_embeddings_model(model_name=model_name, device=device, trust_remote_code=True, use_cache=use_cache)
 
 
 def create_vector_store(texts, embeddings, db_path, use_db="chroma"):
@@ -155,13 +173,18 @@ def create_vector_store(texts, embeddings, db_path, use_db="chroma"):
     :param texts: chunks for which we are constructing the data store
     :param embeddings: vector embeddings for given chunks
     :param db_path: storage path
-    :param use_db: type of data store to use
+    :param use_db: type of data store to use - "chroma", or "ivf" for the quantized ANN index of ann_index
     :return: None
     """
     flag = True
     try:
         if use_db == "chroma":
-            db = Chroma.from_documents(texts, embeddings, persist_directory=db_path)
+            # chunk ids become the Chroma ids so that hits of the sparse index can be fetched from the store
+            ids = [t.metadata.get("chunk_id") for t in texts]
+            db = Chroma.from_documents(texts, embeddings, persist_directory=db_path, ids=ids if all(ids) else None)
+        elif use_db == "ivf":
+            db = IVFVectorStore.from_documents(texts, embeddings, persist_directory=ann_path(db_path),
+                                               ids=[t.metadata.get("chunk_id") or str(i) for i, t in enumerate(texts)])
         else:
             print("Unknown db type, exiting!")
             db = None
@@ -175,6 +198,21 @@ def create_vector_store(texts, embeddings, db_path, use_db="chroma"):
     return flag
 
 
+def build_sparse_index(texts, path=SPARSE_INDEX_PATH):
+    """
+    Build the BM25 index of the chunks, keyed by their chunk_id, and persist it next to the vector store
+    :param texts: chunks returned by get_chunks
+    :param path: file where the index is saved
+    :return: the index
+    """
+    index = BM25Index()
+    for t in texts:
+        index.add(t.metadata["chunk_id"], t.page_content)
+    index.save(path)
+    print(f"Sparse index saved: {len(index)} chunks, {len(index.postings)} terms")
+    return index
+
+
 def ingest():
     """
     Ingest PDF files from the given data source.
@@ -191,9 +229,54 @@ def ingest():
     print(f"Number of documents from get_docs: {len(docs)}, Number of chunks from get_chunks: {len(texts)}")
 
     embs_model = get_embeddings_model(device=device)
+    # the chunks of the previous version of every file are replaced, not kept next to the new ones
+    purge_sources(Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embs_model),
+                  {t.metadata.get("source", "") for t in texts})
     flag = create_vector_store(texts, embs_model, DB_CHROMA_PATH, use_db="chroma")
     if flag:
         print("Vector Store Created!")
+        build_sparse_index(texts)
+
+
+def ingest_shared():
+    """
+    Ingest into the shared store of corpus_registry, chunks already stored for another CONTENT_ID are not embedded again
+    """
+    texts = get_chunks(get_docs())
+    return get_corpus_registry(device=device).add_chunks(CONTENT_ID, texts)
+
+
+def split_code_docs(docs, chunk_size=1024, chunk_overlap=128, chunker=CODE_CHUNKER):
+    """
+    split documents of either language, used by the streaming pipeline which receives one file at a time
+    """
+    chunks = []
+    for doc in docs:
+        lang = "python" if doc.metadata.get("source", "").endswith(".py") else "rust"
+        split_fn = partial(split_batch, lang=lang, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        if chunker == "ast":
+            split_fn = partial(chunk_documents, max_chars=MAX_CHUNK_CHARS, fallback=split_fn)
+        for chunk in split_fn([doc]):
+            chunk.metadata["language"] = lang
+            chunks.append(chunk)
+    return chunks
+
+
+def ingest_streaming(batch_size=64, workers=INGEST_WORKERS):
+    """
+    Streaming variant of ingest(): files are parsed, chunked, embedded and upserted in bounded batches
+    :param batch_size: number of chunks embedded and written to the store together
+    :param workers: number of parsing processes
+    :return: None
+    """
+    py_paths = sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.py"), recursive=True))
+    rs_paths = sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.rs"), recursive=True))
+    sparse_index = load_or_create(SPARSE_INDEX_PATH)  # updated in place, chunks already present are replaced
+    total = run_streaming_ingest(py_paths + rs_paths, load_code_file, split_code_docs,
+                                 get_embeddings_model(device=device), DB_CHROMA_PATH,
+                                 batch_size=batch_size, workers=workers, sparse_index=sparse_index)
+    sparse_index.save(SPARSE_INDEX_PATH)
+    print(f"Vector Store Updated with {total} chunks!")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+"""
+Ingest manifest - records a content hash per source file and per chunk so that a re-run of the
+ingestion only embeds what changed since the previous run.
+
+Layout of the manifest (json):
+{
+    "files": {
+        "<source path>": {
+            "hash": "<sha256 of file bytes>",
+            "chunks": {"<chunk id>": "<sha256 of chunk text>", ...}
+        },
+        ...
+    }
+}
+"""
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Compute the sha256 of a file without reading it fully into memory
+    :param path: path of the file
+    :param block_size: number of bytes read per step
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_chunk_ids(chunks, seen=None):
+    """
+    Assign a deterministic id to every chunk: the id depends on the source file, the chunk text and
+    the occurrence number of that text within the file. An unchanged chunk therefore keeps its id
+    across runs even when other parts of the same file are edited.
+    :param chunks: list of chunked Langchain documents (all chunks of one or more files)
+    :param seen: occurrence counts from previous calls, pass the same dict when the chunks of a file
+                 arrive in several batches
+    :return: list of (chunk_id, chunk_hash) in the same order as chunks
+    """
+    if seen is None:
+        seen = {}
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        c_hash = text_hash(chunk.page_content)
+        key = (source, c_hash)
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        chunk_id = text_hash(f"{source}|{c_hash}|{occurrence}")[:32]
+        ids.append((chunk_id, c_hash))
+    return ids
+
+
+def build_manifest(chunks):
+    """
+    Manifest of a full ingest, so that the next incremental run only embeds what changed
+    :param chunks: all the chunks written, with their make_chunk_ids id in metadata["chunk_id"]
+    :return: manifest dict
+    """
+    files = {}
+    for chunk in chunks:
+        source = chunk.metadata["source"]
+        entry = files.get(source)
+        if entry is None:
+            entry = files[source] = {"hash": file_hash(source), "chunks": {}}
+        entry["chunks"][chunk.metadata["chunk_id"]] = text_hash(chunk.page_content)
+    return {"files": files}
+
+
+def load_manifest(path):
+    """
+    Load the manifest if present, else return an empty one
+    :param path: manifest file path
+    :return: manifest dict
+    """
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """
+    Save the manifest atomically so that an interrupted run never leaves a truncated file behind
+    :param manifest: manifest dict
+    :param path: manifest file path
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def diff_files(manifest, paths):
+    """
+    Compare the files on disk with the manifest
+    :param manifest: manifest dict
+    :param paths: source files currently present under the data path
+    :return: (new_or_changed, unchanged, removed, hashes) where hashes maps every path to its current hash
+    """
+    known = manifest["files"]
+    hashes = {path: file_hash(path) for path in paths}
+
+    changed = [p for p in paths if p not in known or known[p]["hash"] != hashes[p]]
+    unchanged = [p for p in paths if p in known and known[p]["hash"] == hashes[p]]
+    removed = [p for p in known if p not in hashes]
+    return changed, unchanged, removed, hashes
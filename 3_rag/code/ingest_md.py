@@ -3,92 +3,71 @@ Naive RAG - Implementation Example
 Ingest md and mdx files - LangGraph documentation (cleaned)
 """
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from traceback import print_exc
 from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from functools import partial
+
+from core.rag_agents.parallel_ingest import INGEST_WORKERS, parallel_map, batched, flatten, chunk_batch_size
+from core.rag_agents.streaming_ingest import run_streaming_ingest, tag_chunk_ids, purge_sources
+from core.rag_agents.embedding_models import build_embeddings_model
+from core.rag_agents.device_config import resolve_device
+from core.rag_agents.ann_index import IVFVectorStore, ann_path
+from core.rag_agents.mdx_cleaner import clean_mdx  # linear time, same output as the former 7 re.sub passes
+from core.rag_agents.corpus_registry import store_path, get_corpus_registry
 
 import glob
-import re
 import os
 
 # Paths
 DATA_PATH = r"C:\home\ananth\research\packages\docs\src\oss"
 
-device = "cuda"  # use "mps" for Mac
+device = resolve_device()  # "cuda", "mps" or "cpu" - set EMBEDDINGS_DEVICE to force one
 
 # CONTENT_ID = "langgraph_docs"
 CONTENT_ID = "langchain_ai_docs"
-DB_CHROMA_PATH = "vector_stores/db_chroma" + "_" + CONTENT_ID
+DB_CHROMA_PATH = store_path(CONTENT_ID)
 EMBEDDINGS_MODEL = "thenlper/gte-large"
 
 
 # ------------------------------------------------------
-# CLEANING / NORMALIZATION FOR MDX FILES
+# LOAD MD + MDX FILES
 # ------------------------------------------------------
 
-def clean_mdx(text: str) -> str:
-    """Convert MDX → clean Markdown by removing JSX noise and MDX components."""
-
-    # --- Remove frontmatter ---
-    text = re.sub(r"^---[\s\S]+?---", "", text, flags=re.MULTILINE)
-
-    # --- Remove JSX components with bodies (Info, Tabs, Tip, Note, etc) ---
-    text = re.sub(r"<[A-Za-z0-9_]+[^>]*>[\s\S]*?</[A-Za-z0-9_]+>", "", text)
-
-    # --- Remove single tags (self-closing JSX like <Tip />) ---
-    text = re.sub(r"<[^>]+/>", "", text)
-
-    # --- Convert :::python → ```python ---
-    text = re.sub(r":::python", "```python", text)
-    text = re.sub(r":::js", "```javascript", text)
-    text = re.sub(r":::", "```", text)
-
-    # --- Remove leftover HTML tags ---
-    text = re.sub(r"<[^>]+>", "", text)
-
-    return text.strip()
-
+def load_md_file(path):
+    """Read one .md / .mdx file and return it as a Document. Runs in a worker process when loading in parallel."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+
+    # Clean MDX files
+    if path.endswith(".mdx"):
+        cleaned = clean_mdx(raw)
+    else:
+        cleaned = raw
+
+    # Create a LangChain Document manually
+    return Document(
+        page_content=cleaned,
+        metadata={
+            "source": path,
+            "source_path": path,
+            "filename": os.path.basename(path),
+            "filetype": "mdx" if path.endswith(".mdx") else "md"
+        },
+    )
 
-# ------------------------------------------------------
-# LOAD MD + MDX FILES
-# ------------------------------------------------------
 
-def get_docs():
-    """Load both .md and .mdx files with MDX cleaning applied."""
+def get_docs(workers=INGEST_WORKERS):
+    """Load both .md and .mdx files with MDX cleaning applied, files are parsed by a pool of workers."""
 
     filepaths = (
-        glob.glob(os.path.join(DATA_PATH, "**", "*.md"), recursive=True)
-        + glob.glob(os.path.join(DATA_PATH, "**", "*.mdx"), recursive=True)
+        sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.md"), recursive=True))
+        + sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.mdx"), recursive=True))
     )
 
-    docs = []
-    for path in filepaths:
-        try:
-            raw = open(path, "r", encoding="utf-8").read()
-
-            # Clean MDX files
-            if path.endswith(".mdx"):
-                cleaned = clean_mdx(raw)
-            else:
-                cleaned = raw
-
-            # Create a LangChain Document manually
-            from langchain_core.documents import Document
-            doc = Document(
-                page_content=cleaned,
-                metadata={
-                    "source": path,
-                    "source_path": path,
-                    "filename": os.path.basename(path),
-                    "filetype": "mdx" if path.endswith(".mdx") else "md"
-                },
-            )
-            docs.append(doc)
-
-        except Exception as e:
-            print(f"Error reading {path}: {e}")
-
+    # a file that cannot be read is reported and skipped, the other files are kept
+    docs, _ = parallel_map(load_md_file, filepaths, workers=workers, label="file")
     return docs
 
 
@@ -96,7 +75,7 @@ def get_docs():
 # CHUNKING
 # ------------------------------------------------------
 
-def get_chunks(docs, chunk_size=2048, chunk_overlap=200):
+def split_batch(docs, chunk_size, chunk_overlap):
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
@@ -104,17 +83,21 @@ def get_chunks(docs, chunk_size=2048, chunk_overlap=200):
     return text_splitter.split_documents(docs)
 
 
+def get_chunks(docs, chunk_size=2048, chunk_overlap=200, workers=INGEST_WORKERS):
+    split_fn = partial(split_batch, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    results, _ = parallel_map(split_fn, batched(docs, chunk_batch_size(len(docs), workers)),
+                              workers=workers, label="batch")
+    return tag_chunk_ids(flatten(results))  # same ids as ingest_streaming
+
+
 # ------------------------------------------------------
 # EMBEDDINGS
 # ------------------------------------------------------
 
-def get_embeddings_model(model_name=None, device=device):
+def get_embeddings_model(model_name=None, device=device, use_cache=True):
     if model_name is None:
         model_name = EMBEDDINGS_MODEL
-    return HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs={"device": device, "trust_remote_code": True}
-    )
+    return build_embeddings_model(model_name=model_name, device=device, trust_remote_code=True, use_cache=use_cache)
 
 
 # ------------------------------------------------------
@@ -124,9 +107,14 @@ def get_embeddings_model(model_name=None, device=device):
 def create_vector_store(texts, embeddings, db_path, use_db="chroma"):
     try:
         if use_db == "chroma":
-            db = Chroma.from_documents(texts, embeddings, persist_directory=db_path)
+            ids = [t.metadata.get("chunk_id") for t in texts]
+            db = Chroma.from_documents(texts, embeddings, persist_directory=db_path, ids=ids if all(ids) else None)
             db.persist()
             return True
+        elif use_db == "ivf":  # quantized ANN index of ann_index
+            IVFVectorStore.from_documents(texts, embeddings, persist_directory=ann_path(db_path),
+                                          ids=[t.metadata.get("chunk_id") or str(i) for i, t in enumerate(texts)])
+            return True
         else:
             print("Unknown DB type.")
             return False
@@ -152,12 +140,35 @@ def ingest():
     print(f"Chunks created: {len(chunks)}")
 
     embeddings = get_embeddings_model()
+    # the chunks of the previous version of every file are replaced, not kept next to the new ones
+    purge_sources(Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embeddings),
+                  {c.metadata.get("source", "") for c in chunks})
     ok = create_vector_store(chunks, embeddings, DB_CHROMA_PATH)
 
     if ok:
         print("Vector Store Created!")
 
 
+def ingest_shared():
+    """
+    Ingest into the shared store of corpus_registry, chunks already stored for another CONTENT_ID are not embedded again
+    """
+    chunks = get_chunks(get_docs())
+    return get_corpus_registry(device=device).add_chunks(CONTENT_ID, chunks)
+
+
+def ingest_streaming(batch_size=64, workers=INGEST_WORKERS):
+    """Streaming variant of ingest(): files are loaded, cleaned, chunked, embedded and upserted in bounded batches."""
+    filepaths = (
+        sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.md"), recursive=True))
+        + sorted(glob.glob(os.path.join(DATA_PATH, "**", "*.mdx"), recursive=True))
+    )
+    split_fn = partial(split_batch, chunk_size=2048, chunk_overlap=200)
+    total = run_streaming_ingest(filepaths, load_md_file, split_fn, get_embeddings_model(), DB_CHROMA_PATH,
+                                 batch_size=batch_size, workers=workers)
+    print(f"Vector Store Updated with {total} chunks!")
+
+
 if __name__ == '__main__':
     ingest()
 
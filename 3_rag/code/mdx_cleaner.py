@@ -0,0 +1,225 @@
+"""
+Linear time MDX -> Markdown cleaner used by ingest_md.
+The original clean_mdx() ran seven re.sub passes; its lazy "<Tag>[\\s\\S]*?</Tag>" pattern restarts a scan to the
+end of the file at every "<" when there is no closing tag, which is quadratic on large or malformed docs.
+clean_mdx() below produces exactly the same output as that cascade (kept as clean_mdx_regex, the reference) with
+scanners that only move forward:
+1. frontmatter "---...---" starting at a line start
+2. JSX components with a body: <Tag ...> ... </Tag>
+3. self-closing tags: <Tip />
+4. ":::python" / ":::js" / ":::" fences and leftover HTML tags, fused in a single pass
+Each step works on the output of the previous one, as the regex cascade did - removing a block can bring two
+fragments together into a new match - so steps 1 to 3 stay separate passes, each of them linear.
+verify_golden() checks the equivalence on a corpus and benchmark() reports the throughput of both cleaners,
+including adversarial inputs.
+"""
+import re
+import sys
+import glob
+import os
+import time
+
+FRONTMATTER_RE = re.compile(r"^---", re.MULTILINE)
+OPENING_RE = re.compile(r"<[A-Za-z0-9_]")
+CLOSING_RE = re.compile(r"</[A-Za-z0-9_]+>")
+COLONS_RE = re.compile(r":+")
+SPECIAL_RE = re.compile(r"[<:]")
+
+
+def clean_mdx_regex(text: str) -> str:
+    """Convert MDX → clean Markdown by removing JSX noise and MDX components."""
+
+    # --- Remove frontmatter ---
+    text = re.sub(r"^---[\s\S]+?---", "", text, flags=re.MULTILINE)
+
+    # --- Remove JSX components with bodies (Info, Tabs, Tip, Note, etc) ---
+    text = re.sub(r"<[A-Za-z0-9_]+[^>]*>[\s\S]*?</[A-Za-z0-9_]+>", "", text)
+
+    # --- Remove single tags (self-closing JSX like <Tip />) ---
+    text = re.sub(r"<[^>]+/>", "", text)
+
+    # --- Convert :::python → ```python ---
+    text = re.sub(r":::python", "```python", text)
+    text = re.sub(r":::js", "```javascript", text)
+    text = re.sub(r":::", "```", text)
+
+    # --- Remove leftover HTML tags ---
+    text = re.sub(r"<[^>]+>", "", text)
+
+    return text.strip()
+
+
+def strip_frontmatter(text):
+    """
+    remove "---" at a line start up to the next "---" at least one char further
+    """
+    out = []
+    pos = 0
+    for m in iter(lambda: FRONTMATTER_RE.search(text, pos), None):
+        end = text.find("---", m.start() + 4)
+        if end < 0:  # no closing "---": no later line can match either
+            break
+        out.append(text[pos:m.start()])
+        pos = end + 3
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def strip_jsx_blocks(text):
+    """
+    remove "<Name ...>" up to the first "</Name2>" after it (the tag names do not have to match, as in the regex)
+    """
+    out = []
+    pos = 0
+    search = 0
+    while True:
+        m = OPENING_RE.search(text, search)
+        if m is None:
+            break
+        start = m.start()
+        gt = text.find(">", start + 2)
+        if gt < 0:  # no ">" left: no opening tag can complete
+            break
+        closing = CLOSING_RE.search(text, gt + 1)
+        if closing is None:  # every later opening would search a suffix of the same text
+            break
+        out.append(text[pos:start])
+        pos = search = closing.end()
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def strip_self_closing(text):
+    """
+    remove "<...  />": from a "<" to the first ">" after it, when that ">" follows a "/" and encloses at least one char
+    """
+    out = []
+    pos = 0
+    gt = -1  # first ">" after the current "<", shared by all the "<" before it
+    start = text.find("<")
+    while start >= 0:
+        if gt <= start:
+            gt = text.find(">", start + 1)
+            if gt < 0:
+                break
+        if gt >= start + 3 and text[gt - 1] == "/":
+            out.append(text[pos:start])
+            pos = gt + 1
+            start = text.find("<", pos)
+        else:
+            start = text.find("<", start + 1)
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def _fence(n_colons):
+    """
+    ":" * n after the ":::" -> "```" replacement, matches are taken from the left
+    """
+    return "```" * (n_colons // 3) + ":" * (n_colons % 3)
+
+
+def convert_fences_and_tags(text):
+    """
+    ":::python" -> "```python", ":::js" -> "```javascript", ":::" -> "```" and removal of "<...>" in one pass.
+    The fences are converted before the tags are removed, as in the regex cascade: a run of colons is never joined
+    to "python" across a removed tag.
+    """
+    out = []
+    pos = 0
+    gt = -1
+    tags = True  # False once there is no ">" left
+    for m in iter(lambda: SPECIAL_RE.search(text, pos), None):
+        start = m.start()
+        out.append(text[pos:start])
+        if text[start] == "<":
+            if tags and gt <= start:
+                gt = text.find(">", start + 1)
+                tags = gt >= 0
+            if tags and gt >= start + 2:
+                pos = gt + 1  # drop the tag
+            else:
+                out.append("<")
+                pos = start + 1
+            continue
+
+        end = COLONS_RE.match(text, start).end()
+        n = end - start
+        if n >= 3 and text.startswith("python", end):
+            out.append(_fence(n - 3) + "```python")
+            pos = end + 6
+        elif n >= 3 and text.startswith("js", end):
+            out.append(_fence(n - 3) + "```javascript")
+            pos = end + 2
+        else:
+            out.append(_fence(n))
+            pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def clean_mdx(text: str) -> str:
+    """Convert MDX → clean Markdown by removing JSX noise and MDX components, in linear time."""
+    text = strip_frontmatter(text)
+    text = strip_jsx_blocks(text)
+    text = strip_self_closing(text)
+    return convert_fences_and_tags(text).strip()
+
+
+def verify_golden(paths):
+    """
+    compare clean_mdx() with the regex reference on a corpus of files
+    :return: list of the paths with a different output
+    """
+    mismatches = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if clean_mdx(text) != clean_mdx_regex(text):
+            mismatches.append(path)
+            print("Mismatch: ", path)
+    print(f"Golden check: {len(paths) - len(mismatches)} / {len(paths)} files identical")
+    return mismatches
+
+
+def adversarial_inputs(size=200_000):
+    """
+    inputs on which the regex cascade is quadratic: openings without a closing tag, frontmatter openings without
+    an end, "<" without ">"
+    """
+    return {
+        "unclosed_tags": "<Tip>" * (size // 5),
+        "unclosed_frontmatter": "---\n" * (size // 4),
+        "lone_lt": "<a " * (size // 3),
+    }
+
+
+def benchmark(texts, repeat=3):
+    """
+    :param texts: dict name -> text
+    :return: dict name -> {"linear_mb_s", "regex_mb_s"}
+    """
+    report = {}
+    for name, text in texts.items():
+        mb = len(text) / 1e6
+        timings = {}
+        for label, fn in (("linear", clean_mdx), ("regex", clean_mdx_regex)):
+            t1 = time.perf_counter()
+            for _ in range(repeat):
+                fn(text)
+            timings[label] = (time.perf_counter() - t1) / repeat
+        report[name] = {"linear_mb_s": mb / timings["linear"], "regex_mb_s": mb / timings["regex"]}
+        print(f"{name:>20}: {mb:.2f} MB  linear {report[name]['linear_mb_s']:8.2f} MB/s  "
+              f"regex {report[name]['regex_mb_s']:8.2f} MB/s")
+    return report
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    files = sorted(glob.glob(os.path.join(root, "**", "*.mdx"), recursive=True))
+    verify_golden(files)
+    corpus = ""
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            corpus += f.read() + "\n"
+    benchmark({"corpus": corpus, **adversarial_inputs(20_000)}, repeat=1)
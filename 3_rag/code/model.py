@@ -1,9 +1,13 @@
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from ingest import EMBEDDINGS_MODEL, DB_CHROMA_PATH
+# one import path for the shared modules: a second one (bare names) would create a second resource registry
+from core.rag_agents.ingest import EMBEDDINGS_MODEL, DB_CHROMA_PATH
+from core.rag_agents.device_config import resolve_device
+from core.rag_agents.rag_resources import registry, get_vectordb, get_llm, warmup
+from core.rag_agents.rag_cache import get_result_cache
+from core.rag_agents.reranker import RAG_RERANK, RERANK_FETCH_K, rerank_docs, get_reranker
+from core.rag_agents.batch_retrieval import retrieve_many as batch_retrieve_many
 
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import OpenAI
+from core.session1_foundations.llm_clients import get_completion_model  # pooled keep-alive connections
 from core.ip_config import PC_BASE_URL, MAC_BASE_URL
 
 # from get_llm import load_llm_client
@@ -34,7 +38,8 @@ def load_llm(base_url=None, api_key=None, temperature=0.00001, max_tokens=10000)
 
     if api_key is None: api_key = "lm_studio"
 
-    return OpenAI(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens, model="google/gemma-3-12b")
+    return get_completion_model(base_url, api_key, temperature=temperature, max_tokens=max_tokens,
+                                model="google/gemma-3-12b")
 
 
 def load_llm_remote(base_url=PC_BASE_URL, api_key=None, temperature=0.00001, max_tokens=10000):
@@ -42,7 +47,7 @@ def load_llm_remote(base_url=PC_BASE_URL, api_key=None, temperature=0.00001, max
     A helper function to load a remote LLM instance
     :return: a client instance for the LLM running remotely
     """
-    return OpenAI(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    return get_completion_model(base_url, api_key, temperature=temperature, max_tokens=max_tokens)
 
 
 def set_custom_prompt():
@@ -83,14 +88,21 @@ def get_retriever():
     after texts are ingested in vectordb, get it as a retriever
     :return:
     """
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDINGS_MODEL,
-                                       model_kwargs={'device': 'cuda'})
-    vectordb = Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embeddings)
-    return vectordb
+    # opened once per process, later calls return the same instance
+    return get_vectordb(DB_CHROMA_PATH, EMBEDDINGS_MODEL, resolve_device())
+
+
+def retrieve_many(queries, k=8):
+    """
+    retrieve the documents of several queries with one batched embedding and one search over the store
+    :return: list (one per query) of lists of documents
+    """
+    return batch_retrieve_many(get_retriever(), queries, k=k)
 
 
 # ---------------------------------------- RAG Entry Point for tool call -----------------------------------
-def do_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000):
+def do_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000, use_cache=True,
+           rerank=RAG_RERANK):
     """
     Given a query, perform Naive RAG using the vector database and return the result
     :param query: query to be executed
@@ -98,16 +110,33 @@ def do_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=1
     :param api_key: api key to authenticate with the LLM
     :param temperature: temperature setting - 0.0 means least variety, > 0.5 means higher variety
     :param max_tokens: Maximum number of tokens to use when generating the output.
+    :param use_cache: return the cached answer of the same or a very similar query when there is one
+    :param rerank: over-fetch candidates and keep the best ones by cross-encoder score
     :return: results from Naive RAG
     """
-    # 1. get a reference to the vector database using get_retriever function and cast it as retriever
+    # 0. Get an instance of LLM using load_llm() or load_llm_remote, its settings are part of the cache key
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    print("LLM Loaded: ", llm)
+
+    # 1. answer from the result cache when the same (or a semantically close) question was already answered
+    query_vector = None
+    if use_cache:
+        cache = get_result_cache(EMBEDDINGS_MODEL, resolve_device())
+        answer, query_vector = cache.lookup(query, DB_CHROMA_PATH, custom_prompt_template, llm=llm)
+        if answer is not None:
+            return answer
+
+    # 2. get a reference to the vector database using get_retriever function and cast it as retriever
     vectordb = get_retriever()
-    retriever = vectordb.as_retriever(search_kwargs={"k": 8})
+    k = RERANK_FETCH_K if rerank else 8
+    retriever = vectordb.as_retriever(search_kwargs={"k": k})
 
-    # 2. Get an instance of LLM using load_llm() or load_llm_remote
-    llm = load_llm(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
-    print("LLM Loaded: ", llm)
-    retrieved_docs = retriever.invoke(query)
+    if query_vector is not None:  # already embedded by the cache lookup
+        retrieved_docs = vectordb.similarity_search_by_vector(query_vector, k=k)
+    else:
+        retrieved_docs = retriever.invoke(query)
+    if rerank:
+        retrieved_docs = rerank_docs(query, retrieved_docs)
 
     # Uncomment the lines below for debugging
     # print("Num retrieved docs = ", len(retrieved_docs))
@@ -123,9 +152,27 @@ def do_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=1
     # 5. Execute the prompt on the LLM
     result = llm.invoke(prompt)
 
+    if use_cache:
+        cache.put(query, DB_CHROMA_PATH, custom_prompt_template, result, query_vector=query_vector, llm=llm)
     return result
 
 
+def warmup_rag():
+    """
+    Load the embedding model, open the vector store and create the LLM client before the first query
+    """
+    warmup(DB_CHROMA_PATH, EMBEDDINGS_MODEL, resolve_device(), llm_factory=load_llm)
+    if RAG_RERANK:
+        get_reranker()
+
+
+def reload_rag():
+    """
+    Drop the cached resources, e.g. after the vector store was re-ingested, they are created again on next use
+    """
+    registry.reload()
+
+
 # ------------------------- RAG Test with command line --------------------------
 def qa_bot():
     query = ""
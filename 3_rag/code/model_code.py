@@ -1,16 +1,35 @@
 """
 model for generating and reviewing code using RAG
 """
+import os
 import json
-from langchain_openai import OpenAI
+import time
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from core.session1_foundations.llm_clients import get_completion_model  # pooled keep-alive connections
 from langchain_core.prompts import PromptTemplate
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from core.rag_agents.ingest_code import EMBEDDINGS_MODEL, DB_CHROMA_PATH
+from langchain_core.documents import Document
+from core.rag_agents.ingest_code import EMBEDDINGS_MODEL, DB_CHROMA_PATH, SPARSE_INDEX_PATH
+from core.rag_agents.device_config import resolve_device
+from core.rag_agents.rag_resources import registry, get_vectordb, get_llm, warmup
+from core.rag_agents.rag_cache import get_result_cache
+from core.rag_agents.rag_metrics import METRICS
+from core.rag_agents.sparse_index import load_or_create, rrf_fuse
+from core.rag_agents.context_packer import pack_context, CONTEXT_TOKEN_BUDGET
+from core.rag_agents.reranker import RAG_RERANK, RERANK_FETCH_K, rerank_docs, get_reranker
+from core.rag_agents.batch_retrieval import embed_queries, search_many
 
 from core.ip_config import PC_BASE_URL, MAC_BASE_URL
 
-device = "cuda"  # use "mps" for mac
+device = resolve_device()  # "cuda", "mps" or "cpu" - set EMBEDDINGS_DEVICE to force one
+
+# threads running the embedding + vector search of ado_rag(), bounds the retrieval work in flight
+RAG_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("RAG_EXECUTOR_WORKERS", 4)),
+                                  thread_name_prefix="rag")
+
+# number of candidates taken from each of the dense and sparse rankings before fusion
+HYBRID_FETCH_K = int(os.environ.get("HYBRID_FETCH_K", 20))
 
 # custom_prompt_template = """
 # You are an assistant for question-answering tasks pertaining to Python source code.
@@ -73,18 +92,19 @@ def set_custom_prompt():
 #     return "\n\n".join([d.page_content for d in docs])
 
 
-def format_docs(docs):
-    context = ""
-    for doc in docs:
-        pc = doc.page_content
-        meta = doc.metadata
-        combined = "\n\nChunk Content: " + pc + "\nMetadata: " + json.dumps({"source": meta["source"]}) + "\n"
-        context = context + combined
-        # print("#" * 100)
-        # print(doc)
-    # print(context)
-    # print("-" * 100)
-    return context
+def format_chunk(piece):
+    meta = {"source": piece["source"]}
+    if "qualified_path" in piece["metadata"]:  # chunks of the structural chunker, see code_chunker
+        meta["symbol"] = piece["metadata"]["qualified_path"]
+    return "Chunk Content: " + piece["text"] + "\nMetadata: " + json.dumps(meta) + "\n"
+
+
+def format_docs(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Build the context from the retrieved chunks: duplicates dropped, overlapping chunks of a file merged and
+    packed by relevance within token_budget
+    """
+    return pack_context(docs, token_budget=token_budget, format_piece=format_chunk)
 
 
 def load_llm(base_url=None, api_key=None, temperature=0.00001, max_tokens=10000):
@@ -102,7 +122,8 @@ def load_llm(base_url=None, api_key=None, temperature=0.00001, max_tokens=10000)
 
     if api_key is None: api_key = "lm_studio"
 
-    return OpenAI(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens, model="google/gemma-3-12b")
+    return get_completion_model(base_url, api_key, temperature=temperature, max_tokens=max_tokens,
+                                model="google/gemma-3-12b")
 
 
 def load_llm_remote(base_url=PC_BASE_URL, api_key=None, temperature=0.00001, max_tokens=10000):
@@ -110,7 +131,7 @@ def load_llm_remote(base_url=PC_BASE_URL, api_key=None, temperature=0.00001, max
     A helper function to load a remote LLM instance
     :return: a client instance for the LLM running remotely
     """
-    return OpenAI(base_url=base_url, api_key=api_key, temperature=0.0, max_tokens=10000)
+    return get_completion_model(base_url, api_key, temperature=0.0, max_tokens=10000)
 
 
 def get_retriever():
@@ -118,49 +139,303 @@ def get_retriever():
     after texts are ingested in vectordb, get it as a retriever
     :return:
     """
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDINGS_MODEL,
-                                       model_kwargs={'device': device})
-    vectordb = Chroma(persist_directory=DB_CHROMA_PATH, embedding_function=embeddings)
-    return vectordb
+    # opened once per process, later calls return the same instance
+    return get_vectordb(DB_CHROMA_PATH, EMBEDDINGS_MODEL, device)
 
 
-# ---------------------------------------- RAG Entry Point for tool call -----------------------------------
-def do_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000):
+def get_sparse_index():
     """
-    Given a query, perform Naive RAG using the vector database and return the result
-    :param query: query to be executed
-    :param base_url: This is the endpoint where the LLM is being hosted
-    :param api_key: api key to authenticate with the LLM
-    :param temperature: temperature setting - 0.0 means least variety, > 0.5 means higher variety
-    :param max_tokens: Maximum number of tokens to use when generating the output.
-    :return: results from Naive RAG
+    BM25 index built by ingest_code, loaded once per process - empty when the store was ingested without it
+    """
+    return registry.get(("sparse_index", SPARSE_INDEX_PATH), lambda: load_or_create(SPARSE_INDEX_PATH))
+
+
+def hybrid_search(query, query_vector=None, k=8, fetch_k=HYBRID_FETCH_K, dense_docs=None):
+    """
+    Dense similarity search fused with the BM25 ranking by reciprocal rank fusion, exact identifier matches
+    (function or class names) that the embeddings rank low are brought back in the top k.
+    :param query: query text
+    :param query_vector: embedding of the query if already computed
+    :param k: number of documents returned
+    :param fetch_k: number of candidates taken from each ranking
+    :param dense_docs: dense ranking if already computed, e.g. by retrieve_many()
+    :return: list of documents
+    """
+    vectordb = get_retriever()
+    if dense_docs is None:
+        if query_vector is None:
+            query_vector = vectordb.embeddings.embed_query(query)
+        dense_docs = vectordb.similarity_search_by_vector(query_vector, k=fetch_k)
+
+    index = get_sparse_index()
+    if len(index) == 0:  # no sparse index, dense only
+        return dense_docs[:k]
+
+    t1 = time.perf_counter()
+    sparse_ids = [doc_id for doc_id, _ in index.search(query, k=fetch_k)]
+    docs_by_id = {doc.metadata.get("chunk_id", str(i)): doc for i, doc in enumerate(dense_docs)}
+    fused_ids = rrf_fuse([list(docs_by_id), sparse_ids], top_n=k)
+
+    # chunks found only by the sparse index are fetched from the store by id
+    missing = [doc_id for doc_id in fused_ids if doc_id not in docs_by_id]
+    if missing:
+        found = vectordb.get(ids=missing)
+        for doc_id, text, meta in zip(found["ids"], found["documents"], found["metadatas"]):
+            docs_by_id[doc_id] = Document(page_content=text, metadata=meta)
+    METRICS.observe("hybrid.sparse_ms", (time.perf_counter() - t1) * 1000)
+    return [docs_by_id[doc_id] for doc_id in fused_ids if doc_id in docs_by_id]
+
+
+def retrieve_many(queries, k=8, query_vectors=None, fetch_k=HYBRID_FETCH_K):
+    """
+    Batched hybrid_search() of several queries: the queries are embedded in one forward pass and the dense
+    rankings come from a single search over the store, the BM25 fusion is then done per query.
+    :param queries: list of query texts
+    :param k: number of documents per query
+    :param query_vectors: embeddings of the queries if already computed
+    :param fetch_k: number of candidates taken from each ranking
+    :return: list (one per query) of lists of documents
     """
-    # 1. get a reference to the vector database using get_retriever function and cast it as retriever
     vectordb = get_retriever()
-    retriever = vectordb.as_retriever(search_kwargs={"k": 8})
+    if query_vectors is None:
+        query_vectors = embed_queries(vectordb.embeddings, queries)
+    t1 = time.perf_counter()
+    dense = search_many(vectordb, query_vectors, k=fetch_k)
+    METRICS.observe("retrieve_many.search_ms", (time.perf_counter() - t1) * 1000)
+    METRICS.incr("retrieve_many.queries", len(queries))
+    return [hybrid_search(query, k=k, fetch_k=fetch_k, dense_docs=docs) for query, docs in zip(queries, dense)]
 
-    # 2. Get an instance of LLM using load_llm() or load_llm_remote
-    llm = load_llm(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
-    print("LLM Loaded: ", llm)
-    retrieved_docs = retriever.invoke(query)
+
+# ---------------------------------------- RAG Entry Point for tool call -----------------------------------
+def prepare_rag(query, use_cache=True, rerank=RAG_RERANK, llm=None):
+    """
+    Retrieval half of the RAG, shared by do_rag() and ado_rag(): cache lookup, vector search and prompt.
+    This is the CPU/GPU bound part, ado_rag() runs it off the event loop.
+    :param query: query to be executed
+    :param use_cache: look up the result cache first
+    :param rerank: over-fetch candidates and keep the best ones by cross-encoder score
+    :param llm: LLM that will answer the prompt, its settings are part of the cache key
+    :return: (cached answer or None, prompt or None, query vector or None)
+    """
+    # 0. answer from the result cache when the same (or a semantically close) question was already answered
+    query_vector = None
+    if use_cache:
+        cache = get_result_cache(EMBEDDINGS_MODEL, device)
+        answer, query_vector = cache.lookup(query, DB_CHROMA_PATH, custom_prompt_template, llm=llm)
+        if answer is not None:
+            return answer, None, None
+
+    # 1. dense + BM25 retrieval fused with RRF, the query vector of the cache lookup is reused when there is one
+    retrieved_docs = hybrid_search(query, query_vector=query_vector, k=RERANK_FETCH_K if rerank else 8)
+    if rerank:
+        retrieved_docs = rerank_docs(query, retrieved_docs)
 
     # Uncomment the lines below for debugging
     # print("Num retrieved docs = ", len(retrieved_docs))
     # print(retrieved_docs[0].page_content)
 
-    # 3. Format the list of retrieved documents as a cohesive context, you can include metadata suitably
+    # 2. Format the list of retrieved documents as a cohesive context, you can include metadata suitably
     context = format_docs(retrieved_docs)
 
-    # 4. Given the context form a complete prompt by including other instructions
+    # 3. Given the context form a complete prompt by including other instructions
     prompt = set_custom_prompt()
     prompt = prompt.format(context=context, question=query)
+    return None, prompt, query_vector
+
 
-    # 5. Execute the prompt on the LLM
+def prepare_rag_many(queries, use_cache=True, rerank=RAG_RERANK, llm=None):
+    """
+    prepare_rag() of several queries: one batched embedding for the cache lookups and the retrieval, one search
+    over the store for all the queries that miss the cache
+    :return: (list of cached answers or None, list of prompts or None, list of query vectors), one entry per query
+    """
+    vectordb = get_retriever()
+    query_vectors = embed_queries(vectordb.embeddings, queries)
+    answers = [None] * len(queries)
+    if use_cache:
+        cache = get_result_cache(EMBEDDINGS_MODEL, device)
+        answers = [cache.lookup(query, DB_CHROMA_PATH, custom_prompt_template, query_vector=vector, llm=llm)[0]
+                   for query, vector in zip(queries, query_vectors)]
+
+    misses = [i for i, answer in enumerate(answers) if answer is None]
+    prompts = [None] * len(queries)
+    retrieved = retrieve_many([queries[i] for i in misses], k=RERANK_FETCH_K if rerank else 8,
+                              query_vectors=[query_vectors[i] for i in misses])
+    template = set_custom_prompt()
+    for i, retrieved_docs in zip(misses, retrieved):
+        if rerank:
+            retrieved_docs = rerank_docs(queries[i], retrieved_docs)
+        prompts[i] = template.format(context=format_docs(retrieved_docs), question=queries[i])
+    return answers, prompts, query_vectors
+
+
+def do_rag_many(queries, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000, use_cache=True,
+                rerank=RAG_RERANK):
+    """
+    do_rag() of several related queries, e.g. the sub-questions of an agent: batched retrieval and one
+    llm.batch() call for the prompts, the LLM requests run concurrently
+    :param queries: list of queries
+    :return: list of results, in the order of the queries
+    """
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    answers, prompts, query_vectors = prepare_rag_many(queries, use_cache=use_cache, rerank=rerank, llm=llm)
+    misses = [i for i, prompt in enumerate(prompts) if prompt is not None]
+    if misses:
+        for i, result in zip(misses, llm.batch([prompts[i] for i in misses])):
+            answers[i] = result
+            if use_cache:
+                get_result_cache(EMBEDDINGS_MODEL, device).put(queries[i], DB_CHROMA_PATH, custom_prompt_template,
+                                                               result, query_vector=query_vectors[i], llm=llm)
+    return answers
+
+
+async def ado_rag_many(queries, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000,
+                       use_cache=True, rerank=RAG_RERANK):
+    """
+    Async variant of do_rag_many() for the MCP servers, the retrieval runs in RAG_EXECUTOR
+    """
+    loop = asyncio.get_running_loop()
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    answers, prompts, query_vectors = await loop.run_in_executor(
+        RAG_EXECUTOR, partial(prepare_rag_many, queries, use_cache, rerank, llm=llm))
+    misses = [i for i, prompt in enumerate(prompts) if prompt is not None]
+    if misses:
+        for i, result in zip(misses, await llm.abatch([prompts[i] for i in misses])):
+            answers[i] = result
+            if use_cache:
+                get_result_cache(EMBEDDINGS_MODEL, device).put(queries[i], DB_CHROMA_PATH, custom_prompt_template,
+                                                               result, query_vector=query_vectors[i], llm=llm)
+    return answers
+
+
+def do_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000, use_cache=True,
+           rerank=RAG_RERANK):
+    """
+    Given a query, perform Naive RAG using the vector database and return the result
+    :param query: query to be executed
+    :param base_url: This is the endpoint where the LLM is being hosted
+    :param api_key: api key to authenticate with the LLM
+    :param temperature: temperature setting - 0.0 means least variety, > 0.5 means higher variety
+    :param max_tokens: Maximum number of tokens to use when generating the output.
+    :param use_cache: return the cached answer of the same or a very similar query when there is one
+    :param rerank: over-fetch candidates and keep the best ones by cross-encoder score
+    :return: results from Naive RAG
+    """
+    # 1. Get an instance of LLM using load_llm() or load_llm_remote, its settings are part of the cache key
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+
+    # 2. cache lookup, retrieval and prompt
+    answer, prompt, query_vector = prepare_rag(query, use_cache=use_cache, rerank=rerank, llm=llm)
+    if answer is not None:
+        return answer
+
+    # 3. Execute the prompt on the LLM
     result = llm.invoke(prompt)
 
+    if use_cache:
+        get_result_cache(EMBEDDINGS_MODEL, device).put(query, DB_CHROMA_PATH, custom_prompt_template, result,
+                                                       query_vector=query_vector, llm=llm)
+    return result
+
+
+async def ado_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000, use_cache=True,
+                  rerank=RAG_RERANK):
+    """
+    Async variant of do_rag() for the MCP servers: embedding and vector search run in the bounded RAG_EXECUTOR
+    thread pool, the LLM call goes through the async OpenAI client. The event loop is never blocked, so many
+    in-flight tool calls overlap their waits on the LLM.
+    Parameters and result are the same as do_rag().
+    """
+    loop = asyncio.get_running_loop()
+
+    # 1. cache lookup, retrieval and prompt - off the event loop
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    answer, prompt, query_vector = await loop.run_in_executor(RAG_EXECUTOR,
+                                                              partial(prepare_rag, query, use_cache, rerank, llm=llm))
+    if answer is not None:
+        return answer
+
+    # 2. Execute the prompt on the LLM without blocking the loop
+    result = await llm.ainvoke(prompt)
+
+    if use_cache:
+        get_result_cache(EMBEDDINGS_MODEL, device).put(query, DB_CHROMA_PATH, custom_prompt_template, result,
+                                                       query_vector=query_vector, llm=llm)
     return result
 
 
+def stream_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000, use_cache=True,
+               rerank=RAG_RERANK):
+    """
+    Streaming variant of do_rag(): yields the answer token by token as the OpenAI compatible endpoint produces it,
+    a cached answer is yielded in one piece. The time to first token is observed in METRICS as "rag.ttft_ms".
+    Parameters are the same as do_rag().
+    :return: generator of text chunks
+    """
+    t1 = time.perf_counter()
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    answer, prompt, query_vector = prepare_rag(query, use_cache=use_cache, rerank=rerank, llm=llm)
+    if answer is not None:
+        yield answer
+        return
+
+    chunks = []
+    for chunk in llm.stream(prompt):
+        if not chunks:
+            METRICS.observe("rag.ttft_ms", (time.perf_counter() - t1) * 1000)
+        chunks.append(chunk)
+        yield chunk
+    METRICS.observe("rag.stream_ms", (time.perf_counter() - t1) * 1000)
+
+    if use_cache:
+        get_result_cache(EMBEDDINGS_MODEL, device).put(query, DB_CHROMA_PATH, custom_prompt_template,
+                                                       "".join(chunks), query_vector=query_vector, llm=llm)
+
+
+async def astream_rag(query, base_url=None, api_key=None, temperature=0.00001, max_tokens=10000, use_cache=True,
+                      rerank=RAG_RERANK):
+    """
+    Async variant of stream_rag() for the MCP servers, the retrieval runs in RAG_EXECUTOR
+    :return: async generator of text chunks
+    """
+    t1 = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    llm = get_llm(load_llm, base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens)
+    answer, prompt, query_vector = await loop.run_in_executor(RAG_EXECUTOR,
+                                                              partial(prepare_rag, query, use_cache, rerank, llm=llm))
+    if answer is not None:
+        yield answer
+        return
+
+    chunks = []
+    async for chunk in llm.astream(prompt):
+        if not chunks:
+            METRICS.observe("rag.ttft_ms", (time.perf_counter() - t1) * 1000)
+        chunks.append(chunk)
+        yield chunk
+    METRICS.observe("rag.stream_ms", (time.perf_counter() - t1) * 1000)
+
+    if use_cache:
+        get_result_cache(EMBEDDINGS_MODEL, device).put(query, DB_CHROMA_PATH, custom_prompt_template,
+                                                       "".join(chunks), query_vector=query_vector, llm=llm)
+
+
+def warmup_rag():
+    """
+    Load the embedding model, open the vector store and create the LLM client before the first query
+    """
+    warmup(DB_CHROMA_PATH, EMBEDDINGS_MODEL, device, llm_factory=load_llm)
+    if RAG_RERANK:
+        get_reranker()
+
+
+def reload_rag():
+    """
+    Drop the cached resources, e.g. after the vector store was re-ingested, they are created again on next use
+    """
+    registry.reload()
+
+
 # ------------------------- RAG Test with command line --------------------------
 def qa_bot():
     query = ""
@@ -168,8 +443,9 @@ def qa_bot():
         query = input("Your Query: ")
         if query == "quit":
             break
-        result = do_rag(query)
-        print(result)
+        for chunk in stream_rag(query):  # print the answer as it is generated
+            print(chunk, end="", flush=True)
+        print()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+"""
+Process pool helpers shared by the ingest pipelines.
+Parsing (PDF, MDX, Python AST) and chunking are CPU bound and run one file at a time on a single core,
+these helpers spread the work over a pool of worker processes while keeping the output order deterministic.
+"""
+import os
+import time
+from collections import deque
+from traceback import format_exc
+from concurrent.futures import ProcessPoolExecutor
+
+# number of worker processes, can be set per ingest box with the INGEST_WORKERS environment variable
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+
+
+def batched(items, batch_size):
+    """
+    Split a list into consecutive batches of at most batch_size items
+    :param items: list to be split
+    :param batch_size: max number of items per batch
+    :return: list of lists
+    """
+    return [items[i: i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def parallel_map(func, items, workers=INGEST_WORKERS, label="item"):
+    """
+    Apply func to every item using a process pool.
+    Results are returned in the order of the input items, irrespective of the order in which the workers finish.
+    An exception raised for one item is reported and does not affect the results of the other items.
+    func must be a module level function so that it can be pickled and sent to the workers.
+    :param func: function taking one item
+    :param items: list of items, e.g. file paths or batches of documents
+    :param workers: number of worker processes, 1 runs everything in the current process
+    :param label: name used in the progress and error messages
+    :return: (results, failures) - results of the successful items in input order, list of (item, traceback)
+    """
+    t1 = time.time()
+    results, failures = [], []
+
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                results.append(func(item))
+            except Exception:
+                failures.append((item, format_exc()))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(items))) as executor:
+            futures = [executor.submit(func, item) for item in items]
+            for item, future in zip(items, futures):
+                try:
+                    results.append(future.result())
+                except Exception:
+                    failures.append((item, format_exc()))
+
+    for item, error in failures:
+        print(f"Error processing {label} {repr(item)[:200]}:\n{error}")
+    print(f"Processed {len(items)} {label}(s) with {workers} worker(s) in {time.time() - t1:.2f}s, "
+          f"{len(failures)} failed")
+    return results, failures
+
+
+def parallel_imap(func, items, workers=INGEST_WORKERS, window=None, label="item"):
+    """
+    Lazy variant of parallel_map for the streaming pipelines: yields the results one by one in input order,
+    with at most `window` tasks in flight so that results never pile up faster than they are consumed.
+    Failed items are reported and skipped.
+    :param func: module level function taking one item
+    :param items: iterable of items
+    :param workers: number of worker processes, 1 runs everything in the current process
+    :param window: max number of submitted but not yet consumed tasks, defaults to 2 * workers
+    :param label: name used in the error messages
+    :return: generator of results
+    """
+    if workers <= 1:
+        for item in items:
+            try:
+                yield func(item)
+            except Exception:
+                print(f"Error processing {label} {repr(item)[:200]}:\n{format_exc()}")
+        return
+
+    window = window or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= window:
+                yield from _pop_result(pending, label)
+        while pending:
+            yield from _pop_result(pending, label)
+
+
+def _pop_result(pending, label):
+    item, future = pending.popleft()
+    try:
+        yield future.result()
+    except Exception:
+        print(f"Error processing {label} {repr(item)[:200]}:\n{format_exc()}")
+
+
+def flatten(list_of_lists):
+    return [x for sub_list in list_of_lists for x in sub_list]
+
+
+def chunk_batch_size(num_docs, workers=INGEST_WORKERS):
+    """
+    Number of documents sent to a worker in one task when chunking: a few tasks per worker balances the load
+    without paying the pickling overhead of one task per document.
+    """
+    return max(1, -(-num_docs // (max(workers, 1) * 4)))
@@ -0,0 +1,102 @@
+"""
+In-memory LRU of query text -> embedding in front of the retriever embedding model.
+Repeated and templated queries (exercise scripts, agent retries, the result cache lookup followed by the retrieval)
+embed the exact same string again and again, a gte-large forward pass each time. QueryEmbeddingLRU keeps the most
+recently used query vectors in memory, optionally backed by the persistent EmbeddingCache (same "<model>:query"
+namespace as CachedEmbeddings) so that they survive restarts.
+Hits and misses are counted in METRICS: query_embeddings.hits, query_embeddings.persisted_hits,
+query_embeddings.misses.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from core.rag_agents.embedding_cache import text_key, get_embedding_cache
+from core.rag_agents.rag_metrics import METRICS
+
+QUERY_EMBEDDING_LRU_SIZE = int(os.environ.get("QUERY_EMBEDDING_LRU_SIZE", 4096))  # number of query vectors
+QUERY_EMBEDDING_PERSIST = os.environ.get("QUERY_EMBEDDING_PERSIST", "0") == "1"  # back the LRU with EmbeddingCache
+
+
+class QueryEmbeddingLRU(Embeddings):
+    """
+    Drop-in Embeddings wrapper caching embed_query(), embed_documents() goes straight to the wrapped model
+    """
+
+    def __init__(self, embeddings, model_name, max_entries=QUERY_EMBEDDING_LRU_SIZE, persist=QUERY_EMBEDDING_PERSIST,
+                 cache=None):
+        """
+        :param embeddings: wrapped embedding model
+        :param model_name: its name, namespace of the persisted vectors
+        :param max_entries: max number of query vectors in memory, least recently used are evicted first
+        :param persist: read and write the query vectors missing from memory in the persistent EmbeddingCache
+        :param cache: EmbeddingCache instance, defaults to the shared one
+        """
+        self.embeddings = embeddings
+        # int8 vectors differ slightly, never mix them with the full precision ones (see build_embeddings_model)
+        self.namespace = model_name + (":int8" if getattr(embeddings, "quantize", False) else "") + ":query"
+        self.max_entries = max_entries
+        self.store = (cache if cache is not None else get_embedding_cache()) if persist else None
+        self.entries = OrderedDict()  # text hash -> float32 vector
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        """
+        embed several queries, the ones missing from the cache are embedded in a single call
+        """
+        keys = [text_key(text) for text in texts]
+        found = {}
+        with self.lock:
+            for key in set(keys):
+                vector = self.entries.get(key)
+                if vector is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = vector
+        hits = sum(key in found for key in keys)
+
+        # 1. look up the persistent cache, then embed every distinct query still missing once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        computed = {}
+        if missing and self.store is not None:
+            computed = self.store.get_many(self.namespace, list(missing))
+            METRICS.incr("query_embeddings.persisted_hits", sum(key in computed for key in keys))
+        remaining = {key: text for key, text in missing.items() if key not in computed}
+        if remaining:
+            embed_fn = getattr(self.embeddings, "embed_queries", None) or self.embeddings.embed_documents
+            vectors = dict(zip(remaining, embed_fn(list(remaining.values()))))
+            if self.store is not None:
+                self.store.put_many(self.namespace, vectors)
+            computed.update(vectors)
+
+        # 2. keep the new vectors in memory
+        if computed:
+            with self.lock:
+                for key, vector in computed.items():
+                    found[key] = self.entries[key] = np.asarray(vector, dtype=np.float32)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        METRICS.incr("query_embeddings.hits", hits)
+        METRICS.incr("query_embeddings.misses", sum(key in remaining for key in keys))
+        return [found[key].tolist() for key in keys]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = ["query_embeddings.hits", "query_embeddings.persisted_hits", "query_embeddings.misses"]
+        return {
+            "entries": len(self.entries),
+            "hit_rate": METRICS.ratio("query_embeddings.hits", lookups),
+            "persisted_hit_rate": METRICS.ratio("query_embeddings.persisted_hits", lookups),
+        }
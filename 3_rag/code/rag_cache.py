@@ -0,0 +1,182 @@
+"""
+Query result cache in front of do_rag().
+Two tiers:
+1. exact match on (normalized query, collection, prompt template, LLM settings)
+2. semantic match, opt-in with RAG_CACHE_SEMANTIC=1: a stored answer is returned when the embedding of the new query
+   is within a cosine threshold of the embedding of a cached query for the same namespace. gte-large similarities
+   sit in a narrow band, "what does foo do" and "what does bar do" score close: keep the threshold high.
+The LLM settings (model, base URL, temperature, max tokens) are part of the key, answers of sampled calls
+(temperature above RAG_CACHE_MAX_TEMPERATURE) are never stored.
+Entries expire after a TTL and the least recently used entries are evicted above max_entries.
+Hits and misses are counted in METRICS.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from core.rag_agents.rag_metrics import METRICS
+from core.rag_agents.rag_resources import registry, get_embeddings
+
+RAG_CACHE_SEMANTIC = os.environ.get("RAG_CACHE_SEMANTIC", "0") == "1"
+RAG_CACHE_THRESHOLD = float(os.environ.get("RAG_CACHE_THRESHOLD", 0.98))  # cosine similarity
+RAG_CACHE_MAX_TEMPERATURE = float(os.environ.get("RAG_CACHE_MAX_TEMPERATURE", 0.01))
+RAG_CACHE_TTL = float(os.environ.get("RAG_CACHE_TTL", 24 * 3600))  # seconds
+RAG_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_CACHE_MAX_ENTRIES", 2048))
+
+
+def normalize_query(query):
+    """
+    collapse white space and drop the trailing punctuation so that trivial variants share a key. The case is kept:
+    identifiers that differ only by case (Config / config) are different questions about code.
+    """
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ")
+
+
+def llm_settings(llm):
+    """
+    the settings of a LangChain OpenAI model that change its answers
+    :return: dict, part of the cache namespace
+    """
+    if llm is None:
+        return {}
+    return {"model": getattr(llm, "model_name", None), "base_url": getattr(llm, "openai_api_base", None),
+            "temperature": getattr(llm, "temperature", None), "max_tokens": getattr(llm, "max_tokens", None)}
+
+
+def is_sampled(settings):
+    """
+    True when the answers of an LLM with these settings vary from call to call, they are not cached
+    """
+    if "temperature" not in settings:  # no LLM given, e.g. a cache used outside of the RAG entry points
+        return False
+    temperature = settings["temperature"]
+    return temperature is None or temperature > RAG_CACHE_MAX_TEMPERATURE
+
+
+class QueryResultCache:
+    def __init__(self, embeddings=None, threshold=RAG_CACHE_THRESHOLD, ttl=RAG_CACHE_TTL,
+                 max_entries=RAG_CACHE_MAX_ENTRIES, semantic=RAG_CACHE_SEMANTIC):
+        """
+        :param embeddings: embedding model for the semantic tier, None keeps only the exact match tier
+        :param threshold: min cosine similarity between two queries for a semantic hit
+        :param ttl: time to live of an entry in seconds
+        :param max_entries: max number of cached answers, least recently used are evicted first
+        :param semantic: enable the semantic tier, exact matches only otherwise
+        """
+        self.semantic = semantic and embeddings is not None
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (answer, unit query vector or None, namespace, created)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def namespace(collection, template, settings=None):
+        payload = json.dumps({"template": template, "llm": settings or {}}, sort_keys=True, default=str)
+        return collection + ":" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _expire(self, now):
+        for key in [k for k, entry in self.entries.items() if now - entry[3] > self.ttl]:
+            del self.entries[key]
+
+    def lookup(self, query, collection, template, query_vector=None, llm=None):
+        """
+        :param query: user query
+        :param collection: identifies the vector store, e.g. its persist directory
+        :param template: prompt template used to build the answer
+        :param query_vector: embedding of the query if already computed, e.g. by a batched embedding of several queries
+        :param llm: LangChain model that answers the query, its settings are part of the key
+        :return: (answer or None, query vector) - the query vector is None on an exact hit or without the semantic
+                 tier (unless given), it can be reused for the retrieval on a miss
+        """
+        namespace = self.namespace(collection, template, llm_settings(llm))
+        key = (namespace, normalize_query(query))
+        now = time.time()
+
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                METRICS.incr("rag_cache.exact_hits")
+                return entry[0], None
+
+        if not self.semantic:
+            METRICS.incr("rag_cache.misses")
+            return None, query_vector
+        if query_vector is None:
+            query_vector = self.embeddings.embed_query(query)
+        unit = self._unit(query_vector)
+        with self.lock:
+            keys = [k for k, entry in self.entries.items() if entry[2] == namespace and entry[1] is not None]
+            if keys:
+                scores = np.stack([self.entries[k][1] for k in keys]) @ unit
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.entries.move_to_end(keys[best])
+                    METRICS.incr("rag_cache.semantic_hits")
+                    return self.entries[keys[best]][0], query_vector
+
+        METRICS.incr("rag_cache.misses")
+        return None, query_vector
+
+    def put(self, query, collection, template, answer, query_vector=None, llm=None):
+        """
+        store the answer for the query, query_vector is the one returned by lookup() if any. The answer of a sampled
+        LLM (see is_sampled) is not stored.
+        """
+        settings = llm_settings(llm)
+        if is_sampled(settings):
+            METRICS.incr("rag_cache.skipped_sampled")
+            return
+        namespace = self.namespace(collection, template, settings)
+        unit = None
+        if self.semantic:
+            if query_vector is None:
+                query_vector = self.embeddings.embed_query(query)
+            unit = self._unit(query_vector)
+
+        with self.lock:
+            key = (namespace, normalize_query(query))
+            self.entries[key] = (answer, unit, namespace, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                METRICS.incr("rag_cache.evictions")
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = ["rag_cache.exact_hits", "rag_cache.semantic_hits", "rag_cache.misses"]
+        exact = METRICS.ratio("rag_cache.exact_hits", lookups)
+        semantic = METRICS.ratio("rag_cache.semantic_hits", lookups)
+        return {
+            "entries": len(self.entries),
+            "exact_hit_rate": exact,
+            "semantic_hit_rate": semantic,
+            "hit_rate": exact + semantic,
+        }
+
+
+def get_result_cache(model_name, device=None):
+    """
+    the result cache of this process, its semantic tier (RAG_CACHE_SEMANTIC=1) uses the same embedding model as
+    the retriever
+    """
+    return registry.get(("rag_cache", model_name, device),
+                        lambda: QueryResultCache(
+                            embeddings=get_embeddings(model_name, device) if RAG_CACHE_SEMANTIC else None))
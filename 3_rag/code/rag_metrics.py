@@ -0,0 +1,54 @@
+"""
+Light weight in-process metrics for the RAG path: counters (cache hits, misses, ...) and timings
+(latency, time to first token, ...). snapshot() returns everything as a plain dict that can be printed,
+logged or returned by an MCP tool.
+"""
+import threading
+from collections import deque
+
+
+class Metrics:
+    def __init__(self, window=1000):
+        """
+        :param window: number of most recent samples kept per timing to compute the percentiles
+        """
+        self.window = window
+        self.counters = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self.lock:
+            self.timings.setdefault(name, deque(maxlen=self.window)).append(value)
+
+    def ratio(self, hits, total_names):
+        """
+        e.g. ratio("rag_cache.exact_hits", ["rag_cache.exact_hits", "rag_cache.misses"]) for a hit rate
+        """
+        total = sum(self.counters.get(name, 0) for name in total_names)
+        return self.counters.get(hits, 0) / total if total else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            result = dict(self.counters)
+            for name, samples in self.timings.items():
+                ordered = sorted(samples)
+                result[name] = {
+                    "count": len(ordered),
+                    "p50": ordered[len(ordered) // 2],
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max": ordered[-1],
+                }
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+METRICS = Metrics()
@@ -0,0 +1,117 @@
+"""
+Process wide registry of the heavy RAG resources - embedding model, vector store and LLM client.
+do_rag() used to load the gte-large weights, reopen the Chroma persist directory and build a new LLM client
+on every query. Resources are now created lazily on first use, shared by all the threads of the process
+(e.g. concurrent MCP tool calls) and can be created upfront with warmup() or dropped with reload().
+"""
+import os
+import threading
+
+from langchain_community.vectorstores import Chroma
+
+from core.rag_agents.embedding_models import build_embeddings_model
+from core.rag_agents.query_embedding_cache import QueryEmbeddingLRU
+from core.rag_agents.ann_index import IVFVectorStore, ann_path
+from core.rag_agents.vector_snapshot import SnapshotVectorStore, snapshot_path
+
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")  # "chroma", "ivf" (ann_index) or "snapshot"
+
+
+class ResourceRegistry:
+    """
+    Thread safe map of key -> lazily created resource. Creation of a given key happens once, concurrent callers
+    asking for the same key wait for it, callers asking for other keys are not blocked.
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """
+        :param key: hashable identifier of the resource
+        :param factory: function with no arguments that creates the resource, called only on first use
+        :return: the resource
+        """
+        resource = self._resources.get(key)
+        if resource is not None:
+            return resource
+
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            resource = self._resources.get(key)
+            if resource is None:  # double checked: another thread may have created it while we waited
+                resource = factory()
+                self._resources[key] = resource
+        return resource
+
+    def reload(self, kind=None):
+        """
+        Drop the cached resources, they are created again on next use, e.g. after the vector store was re-ingested
+        :param kind: drop only the keys whose first element is kind ("embeddings", "vectordb", "llm"), None for all
+        """
+        with self._lock:
+            key_locks = list(self._locks.items())
+        for key, key_lock in key_locks:
+            if kind is None or (isinstance(key, tuple) and key[0] == kind):
+                # wait for a creation in progress, it would otherwise store the pre-reload resource after the drop
+                with key_lock:
+                    self._resources.pop(key, None)
+
+    def keys(self):
+        return list(self._resources)
+
+
+registry = ResourceRegistry()
+
+
+def get_embeddings(model_name, device=None):
+    """
+    The retriever embedding model, its query vectors are kept in an LRU (query_embedding_cache)
+    """
+    return registry.get(("embeddings", model_name, device),
+                        lambda: QueryEmbeddingLRU(build_embeddings_model(model_name=model_name, device=device,
+                                                                         use_cache=False), model_name))
+
+
+def open_vectordb(db_path, model_name, device=None, backend=VECTOR_BACKEND):
+    embeddings = get_embeddings(model_name, device)
+    if backend == "ivf":
+        return IVFVectorStore(ann_path(db_path), embedding_function=embeddings)
+    if backend == "snapshot":  # exported with vector_snapshot.export_snapshot
+        return SnapshotVectorStore(snapshot_path(db_path), embedding_function=embeddings)
+    return Chroma(persist_directory=db_path, embedding_function=embeddings)
+
+
+def get_vectordb(db_path, model_name, device=None, backend=VECTOR_BACKEND):
+    """
+    The vector store at db_path, opened once per process with the shared embedding model
+    :param backend: "chroma" for the Chroma store, "ivf" for the IVF index built next to it, "snapshot" for its
+                    memory-mapped read only snapshot
+    """
+    return registry.get(("vectordb", db_path, model_name, device, backend),
+                        lambda: open_vectordb(db_path, model_name, device, backend))
+
+
+def get_llm(factory, **kwargs):
+    """
+    The LLM client created by factory(**kwargs), one instance per distinct set of arguments
+    :param factory: function creating the client, e.g. load_llm or load_llm_remote
+    :param kwargs: arguments of the factory, part of the registry key
+    """
+    key = ("llm", factory.__module__, factory.__name__, tuple(sorted(kwargs.items())))
+    return registry.get(key, lambda: factory(**kwargs))
+
+
+def warmup(db_path, model_name, device=None, llm_factory=None, **llm_kwargs):
+    """
+    Create the resources upfront, e.g. when the MCP server starts, so that the first query does not pay for it.
+    A dummy query is embedded to load the model weights on the device.
+    """
+    vectordb = get_vectordb(db_path, model_name, device)
+    vectordb.embeddings.embed_query("warmup")
+    if llm_factory is not None:
+        get_llm(llm_factory, **llm_kwargs)
+    print("RAG resources ready: ", registry.keys())
@@ -0,0 +1,78 @@
+"""
+Optional rerank stage between the vector search and the prompt.
+The retriever over-fetches RERANK_FETCH_K candidates, a small cross-encoder scores (query, chunk) pairs on CPU in
+batches and only the RERANK_TOP_N best chunks go to the LLM. A shorter prompt of better chunks saves far more LLM
+prefill time than the rerank costs.
+The stage has a per-query latency cap: when the next batch would not finish within RERANK_LATENCY_MS the
+candidates are returned in vector order instead.
+Enable it with RAG_RERANK=1.
+"""
+import os
+import time
+
+from core.rag_agents.rag_metrics import METRICS
+from core.rag_agents.rag_resources import registry
+
+RAG_RERANK = os.environ.get("RAG_RERANK", "0") == "1"
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANKER_DEVICE = os.environ.get("RERANKER_DEVICE", "cpu")
+RERANK_FETCH_K = int(os.environ.get("RERANK_FETCH_K", 24))  # candidates taken from the vector store
+RERANK_TOP_N = int(os.environ.get("RERANK_TOP_N", 5))  # chunks passed to the LLM
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 8))
+RERANK_LATENCY_MS = float(os.environ.get("RERANK_LATENCY_MS", 300))
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name=RERANKER_MODEL, device=RERANKER_DEVICE, batch_size=RERANK_BATCH_SIZE,
+                 latency_ms=RERANK_LATENCY_MS, max_length=512):
+        """
+        :param model_name: cross-encoder model of sentence-transformers
+        :param device: device of the model, a MiniLM cross-encoder is fast enough on CPU
+        :param batch_size: number of (query, chunk) pairs scored per forward pass
+        :param latency_ms: max time spent on one query, None for no cap
+        :param max_length: max number of tokens of a (query, chunk) pair, longer pairs are truncated
+        """
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self.batch_size = batch_size
+        self.latency_ms = latency_ms
+        self.batch_ms = 0.0  # time of the last batch scored, the estimate of the first batch of the next query
+
+    def rerank(self, query, docs, top_n=RERANK_TOP_N):
+        """
+        :param query: user query
+        :param docs: candidate documents in vector order
+        :param top_n: number of documents returned
+        :return: the top_n documents by cross-encoder score, or the first top_n in vector order when the latency
+                 cap would be exceeded
+        """
+        t1 = time.perf_counter()
+        scores = []
+        batch_ms = self.batch_ms
+        for start in range(0, len(docs), self.batch_size):
+            elapsed_ms = (time.perf_counter() - t1) * 1000
+            # the previous batch (of this query or of the last one) is the estimate of the next one, stop before the
+            # cap instead of after it
+            if self.latency_ms is not None and elapsed_ms + batch_ms > self.latency_ms:
+                METRICS.incr("rerank.fallbacks")
+                return docs[:top_n]
+            t2 = time.perf_counter()
+            pairs = [(query, doc.page_content) for doc in docs[start:start + self.batch_size]]
+            scores.extend(self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False))
+            batch_ms = self.batch_ms = (time.perf_counter() - t2) * 1000
+
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        METRICS.observe("rerank.ms", (time.perf_counter() - t1) * 1000)
+        return [docs[i] for i in order[:top_n]]
+
+
+def get_reranker(model_name=RERANKER_MODEL, device=RERANKER_DEVICE):
+    """
+    the reranker of this process, the model is loaded on first use
+    """
+    return registry.get(("reranker", model_name, device), lambda: CrossEncoderReranker(model_name, device))
+
+
+def rerank_docs(query, docs, top_n=RERANK_TOP_N):
+    return get_reranker().rerank(query, docs, top_n=top_n)
@@ -0,0 +1,123 @@
+"""
+Sparse BM25 index over identifiers and tokens, built at ingest time next to the Chroma store of the code RAG.
+Dense retrieval often misses exact identifier matches (function names, class names of nanochat), the sparse
+ranking catches them and both rankings are combined with reciprocal rank fusion (RRF).
+The index is an in-memory inverted index, persisted with pickle and updatable chunk by chunk.
+"""
+import os
+import re
+import math
+import heapq
+import pickle
+from collections import Counter
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text):
+    """
+    Identifiers are kept whole (lower cased) so that an exact function name matches strongly, and are also
+    split on snake_case / camelCase boundaries so that "get_chunks" matches a query about "chunks".
+    """
+    tokens = []
+    for ident in IDENTIFIER_RE.findall(text):
+        lowered = ident.lower()
+        tokens.append(lowered)
+        parts = [p.lower() for part in ident.split("_") if part for p in CAMEL_RE.findall(part)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_len = {}  # doc_id -> number of tokens
+        self.doc_terms = {}  # doc_id -> distinct terms, needed to remove a document
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, doc_id, text):
+        """
+        add or replace a document
+        """
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_terms[doc_id] = list(counts)
+        self.doc_len[doc_id] = sum(counts.values())
+        self.total_len += self.doc_len[doc_id]
+
+    def remove(self, doc_id):
+        for term in self.doc_terms.pop(doc_id, []):
+            posting = self.postings[term]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def search(self, query, k=8, max_df_ratio=0.5):
+        """
+        :param query: query text
+        :param k: number of results
+        :param max_df_ratio: terms present in more than this fraction of the documents (self, return, ...) carry
+                             almost no information and are skipped, this bounds the latency on large posting lists -
+                             a query made only of such terms returns nothing and is left to the dense ranking
+        :return: list of (doc_id, score) sorted by decreasing score
+        """
+        n = len(self.doc_len)
+        if n == 0:
+            return []
+        avg_len = self.total_len / n
+        terms = set(tokenize(query))
+        postings = [(term, self.postings[term]) for term in terms
+                    if term in self.postings and len(self.postings[term]) <= max_df_ratio * n]
+
+        scores = {}
+        for term, posting in postings:
+            df = len(posting)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for doc_id, tf in posting.items():
+                norm = tf + self.k1 * (1.0 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1.0) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        return index
+
+
+def load_or_create(path):
+    return BM25Index.load(path) if os.path.exists(path) else BM25Index()
+
+
+def rrf_fuse(rankings, k=60, top_n=8):
+    """
+    Reciprocal rank fusion: score(d) = sum over rankings of 1 / (k + rank of d)
+    :param rankings: list of rankings, each a list of doc ids best first
+    :param k: damping constant, 60 is the value of the original paper
+    :param top_n: number of fused results
+    :return: list of doc ids best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])]
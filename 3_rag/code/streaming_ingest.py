@@ -0,0 +1,159 @@
+"""
+Streaming ingest pipeline - load -> clean -> chunk -> embed -> upsert as chained generators.
+Only one batch of chunks (plus the documents being parsed by the workers) is held in memory at any time,
+so memory stays flat irrespective of the size of the corpus under DATA_PATH.
+Chunk ids are deterministic (make_chunk_ids, the same ids as the non streaming ingest), a batch is committed to the
+store in a single upsert: an interrupted run leaves the store consistent up to the last committed batch and a re-run
+simply overwrites what was already written. The chunks stored for a file are deleted before its first batch is
+written, so the chunks of the previous version of a changed file do not linger.
+"""
+import time
+from itertools import islice
+
+from langchain_community.vectorstores import Chroma
+
+from core.rag_agents.ingest_manifest import make_chunk_ids
+from core.rag_agents.parallel_ingest import INGEST_WORKERS, parallel_imap
+
+
+def iter_batches(iterable, batch_size):
+    """
+    group the items of an iterable into lists of at most batch_size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_docs(paths, load_fn, workers=INGEST_WORKERS):
+    """
+    Load stage: parse the files in a bounded process pool and yield the documents in file order
+    :param paths: iterable of file paths
+    :param load_fn: module level function returning a document or a list of documents for a path
+    :param workers: number of parsing processes
+    """
+    for result in parallel_imap(load_fn, paths, workers=workers, label="file"):
+        if isinstance(result, list):
+            yield from result
+        else:
+            yield result
+
+
+def iter_cleaned(docs, clean_fn=None):
+    """
+    Clean stage: apply clean_fn to the page_content of every document, pass through when clean_fn is None
+    """
+    for doc in docs:
+        if clean_fn is not None:
+            doc.page_content = clean_fn(doc.page_content)
+        yield doc
+
+
+def iter_chunks(docs, split_fn):
+    """
+    Chunk stage: split one document at a time and tag every chunk with a deterministic chunk_id
+    :param docs: iterable of documents
+    :param split_fn: function taking a list of documents and returning the list of chunks
+    """
+    seen = {}
+    for doc in docs:
+        yield from tag_chunk_ids(split_fn([doc]), seen=seen)
+
+
+def tag_chunk_ids(chunks, seen=None):
+    """
+    set metadata["chunk_id"] of every chunk to its deterministic id, shared by the streaming and the batch ingests
+    :param seen: occurrence counts of make_chunk_ids, pass the same dict when the chunks of a file come in pieces
+    :return: the chunks
+    """
+    for chunk, (chunk_id, _) in zip(chunks, make_chunk_ids(chunks, seen=seen)):
+        chunk.metadata["chunk_id"] = chunk_id
+    return chunks
+
+
+def purge_sources(db, sources, sparse_index=None):
+    """
+    delete the chunks stored for the given source files, before they are ingested again
+    :param db: Chroma vector store
+    :param sources: iterable of source paths (metadata["source"])
+    :param sparse_index: optional BM25Index, the same chunk ids are removed from it
+    :return: number of chunks deleted
+    """
+    deleted = 0
+    for source in sources:
+        ids = db._collection.get(where={"source": source}, include=[])["ids"]
+        if not ids:
+            continue
+        db._collection.delete(ids=ids)
+        if sparse_index is not None:
+            for chunk_id in ids:
+                sparse_index.remove(chunk_id)
+        deleted += len(ids)
+    return deleted
+
+
+def iter_embedded(chunk_batches, embeddings):
+    """
+    Embed stage: one embed_documents call per batch
+    :return: generator of (chunks, vectors)
+    """
+    for batch in chunk_batches:
+        vectors = embeddings.embed_documents([chunk.page_content for chunk in batch])
+        yield batch, vectors
+
+
+def upsert_batches(db, embedded_batches, sparse_index=None):
+    """
+    Upsert stage: write every batch to the Chroma collection in one call, the chunks already stored for a source
+    are deleted before the first batch of that source
+    :param db: Chroma vector store
+    :param embedded_batches: generator of (chunks, vectors)
+    :param sparse_index: optional BM25Index updated with the same chunk ids, saved by the caller
+    :return: number of chunks written
+    """
+    t1 = time.time()
+    total = 0
+    purged = set()
+    for i, (batch, vectors) in enumerate(embedded_batches):
+        sources = {chunk.metadata.get("source", "") for chunk in batch} - purged
+        purge_sources(db, sources, sparse_index=sparse_index)
+        purged |= sources
+        db._collection.upsert(
+            ids=[chunk.metadata["chunk_id"] for chunk in batch],
+            embeddings=vectors,
+            documents=[chunk.page_content for chunk in batch],
+            metadatas=[chunk.metadata for chunk in batch],
+        )
+        if sparse_index is not None:
+            for chunk in batch:
+                sparse_index.add(chunk.metadata["chunk_id"], chunk.page_content)
+        total += len(batch)
+        print(f"Committed batch {i + 1}: {total} chunks in {time.time() - t1:.1f}s")
+    return total
+
+
+def run_streaming_ingest(paths, load_fn, split_fn, embeddings, db_path, clean_fn=None, batch_size=64,
+                         workers=INGEST_WORKERS, sparse_index=None):
+    """
+    Run the full streaming pipeline
+    :param paths: iterable of file paths to ingest
+    :param load_fn: module level function returning the document(s) for a path
+    :param split_fn: function taking a list of documents and returning chunks
+    :param embeddings: embedding model
+    :param db_path: Chroma persist directory
+    :param clean_fn: optional text cleaning function applied before chunking
+    :param batch_size: number of chunks embedded and upserted together
+    :param workers: number of parsing processes
+    :param sparse_index: optional BM25Index kept in sync with the store
+    :return: number of chunks written
+    """
+    db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+
+    docs = iter_docs(paths, load_fn, workers=workers)
+    docs = iter_cleaned(docs, clean_fn)
+    chunks = iter_chunks(docs, split_fn)
+    embedded = iter_embedded(iter_batches(chunks, batch_size), embeddings)
+    return upsert_batches(db, embedded, sparse_index=sparse_index)
@@ -0,0 +1,156 @@
+"""
+Read only snapshot of a vector store for fast retriever startup.
+Opening a Chroma store loads its SQLite/HNSW files in every process, and every MCP server replica on a host holds
+its own copy of the same vectors. export_snapshot() writes a collection once to an immutable directory:
+- vectors.npy: float32 matrix of unit vectors, memory-mapped
+- texts.bin + offsets.npy: the chunk texts as one UTF-8 blob and the byte offset of every chunk, memory-mapped
+- metadata.sqlite: chunk id and metadata by row
+Opening a snapshot only maps the files, it takes milliseconds, and all the processes of the host share the same
+pages through the OS page cache. Search is an exact (brute force) dot product over the mapped matrix, use the IVF
+index of ann_index for corpora where that gets too slow.
+Select it for retrieval with VECTOR_BACKEND=snapshot.
+"""
+import os
+import json
+import mmap
+import time
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+
+from core.rag_agents.ann_index import ReadOnlyVectorStore, iter_chroma_pages, normalize, EXPORT_PAGE_SIZE
+
+SEARCH_BLOCK_ROWS = 65536  # rows scored per matrix product, bounds the temporary memory of a search
+
+
+def snapshot_path(db_path):
+    """
+    directory of the snapshot exported from the vector store at db_path
+    """
+    return db_path.rstrip("/\\") + "_snapshot"
+
+
+def export_snapshot(db_path, path=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Export the Chroma collection at db_path, page by page, the whole collection is never held in memory
+    :param db_path: Chroma persist directory
+    :param path: output directory, replaced if it exists - defaults to snapshot_path(db_path)
+    :param page_size: number of rows read from Chroma per call
+    :return: path
+    """
+    t1 = time.time()
+    path = path or snapshot_path(db_path)
+    count, pages = iter_chroma_pages(db_path, page_size)
+    if not count:  # the vector dimension is unknown and SnapshotIndex needs vectors.npy
+        raise ValueError(f"Vector store {db_path} is empty, ingest it before exporting a snapshot")
+
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    con = sqlite3.connect(os.path.join(tmp_path, "metadata.sqlite"))
+    con.execute("CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT, metadata TEXT)")
+
+    vectors = None
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    row = 0
+    with open(os.path.join(tmp_path, "texts.bin"), "wb") as texts:
+        for page_vectors, ids, documents, metadatas in pages:
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(tmp_path, "vectors.npy"), mode="w+",
+                                                    dtype=np.float32, shape=(count, page_vectors.shape[1]))
+            vectors[row:row + len(ids)] = normalize(page_vectors)
+            for i, document in enumerate(documents):
+                data = (document or "").encode("utf-8")
+                texts.write(data)
+                offsets[row + i + 1] = offsets[row + i] + len(data)
+            con.executemany("INSERT INTO chunks VALUES (?, ?, ?)",
+                            ((row + i, doc_id, json.dumps(metadatas[i] or {})) for i, doc_id in enumerate(ids)))
+            row += len(ids)
+
+    vectors.flush()
+    del vectors
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    con.execute("CREATE INDEX chunks_id ON chunks (id)")
+    con.commit()
+    con.close()
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"Snapshot: {row} chunks exported in {time.time() - t1:.1f}s at {path}")
+    return path
+
+
+class SnapshotIndex:
+    """
+    Memory-mapped view of a snapshot directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "texts.bin"), "rb") as f:
+            # an empty file cannot be mapped
+            self.texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self.con = sqlite3.connect(os.path.join(path, "metadata.sqlite"), check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query_vector, k=8):
+        """
+        exact search by cosine similarity
+        :return: (rows, scores) best first
+        """
+        return self.search_many([query_vector], k=k)[0]
+
+    def search_many(self, query_vectors, k=8):
+        """
+        exact search of several queries, each block of the matrix is scored for all of them in one product
+        :return: list of (rows, scores) best first, one per query
+        """
+        qs = normalize(query_vectors)
+        best_rows = np.empty((len(qs), 0), dtype=np.int64)
+        best_scores = np.empty((len(qs), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), SEARCH_BLOCK_ROWS):
+            scores = qs @ self.vectors[start:start + SEARCH_BLOCK_ROWS].T
+            top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        order = np.argsort(-best_scores, axis=1)[:, :k]
+        return list(zip(np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)))
+
+    def text(self, row):
+        return self.texts[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def fetch(self, rows=None, ids=None):
+        """
+        :return: list of (id, document, metadata) for the given rows (in that order) or ids
+        """
+        with self.lock:
+            if rows is not None:
+                rows = [int(r) for r in rows]
+                query = f"SELECT row, id, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})"
+                found = {r[0]: r for r in self.con.execute(query, rows)}
+                records = [found[r] for r in rows if r in found]
+            else:
+                query = f"SELECT row, id, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})"
+                records = list(self.con.execute(query, list(ids)))
+        return [(doc_id, self.text(row), json.loads(metadata)) for row, doc_id, metadata in records]
+
+
+class SnapshotVectorStore(ReadOnlyVectorStore):
+    def __init__(self, persist_directory, embedding_function):
+        super().__init__(SnapshotIndex(persist_directory), embedding_function)
+
+
+if __name__ == '__main__':
+    from core.rag_agents.ingest_code import DB_CHROMA_PATH
+
+    export_snapshot(DB_CHROMA_PATH)
+    t1 = time.perf_counter()
+    index = SnapshotIndex(snapshot_path(DB_CHROMA_PATH))
+    print(f"Snapshot of {len(index)} chunks opened in {(time.perf_counter() - t1) * 1000:.1f} ms")
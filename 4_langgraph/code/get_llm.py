@@ -1,4 +1,4 @@
-from langchain_openai import ChatOpenAI
+from core.session1_foundations.llm_clients import get_chat_model
 
 
 def get_llm(temperature=0):
@@ -10,11 +10,8 @@ def get_llm(temperature=0):
     :param temperature: between 0 to 1, 0 for no creativity and 1 for maximum creativity due to variance
     :return:
     """
-    llm = ChatOpenAI(
-        base_url="http://localhost:1234/v1",
-        temperature=temperature,
-        api_key="not-needed"
-    )
+    # shares the keep-alive connection pool of the endpoint with every other client of the process
+    llm = get_chat_model("http://localhost:1234/v1", api_key="not-needed", temperature=temperature)
     return llm
 
 
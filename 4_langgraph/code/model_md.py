@@ -2,7 +2,7 @@
 model for generating and reviewing code using RAG
 """
 import json
-from langchain_openai import OpenAI
+from core.session1_foundations.llm_clients import get_completion_model  # pooled keep-alive connections
 from langchain_core.prompts import PromptTemplate
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
@@ -110,7 +110,8 @@ def load_llm(base_url=None, api_key=None, temperature=0.00001, max_tokens=10000)
 
     if api_key is None: api_key = "lm_studio"
 
-    return OpenAI(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens, model="google/gemma-3-12b")
+    return get_completion_model(base_url, api_key, temperature=temperature, max_tokens=max_tokens,
+                                model="google/gemma-3-12b")
 
 
 def load_llm_remote(base_url=LMSTUDIO_PC_URL, api_key=None, temperature=0.00001, max_tokens=10000):
@@ -118,7 +119,7 @@ def load_llm_remote(base_url=LMSTUDIO_PC_URL, api_key=None, temperature=0.00001,
     A helper function to load a remote LLM instance
     :return: a client instance for the LLM running remotely
     """
-    return OpenAI(base_url=base_url, api_key=api_key, temperature=temperature, max_tokens=max_tokens, model=model_name)
+    return get_completion_model(base_url, api_key, temperature=temperature, max_tokens=max_tokens, model=model_name)
 
 
 def get_retriever():
@@ -24,9 +24,24 @@ from multilspy import SyncLanguageServer
 from multilspy.multilspy_config import MultilspyConfig
 from multilspy.multilspy_logger import MultilspyLogger
 
+
+def resolve_device():
+    """
+    "cuda", "mps" or "cpu", whichever is available - set EMBEDDINGS_DEVICE to force one
+    """
+    if os.environ.get("EMBEDDINGS_DEVICE"):
+        return os.environ["EMBEDDINGS_DEVICE"]
+    import torch  # installed with sentence-transformers, used by HuggingFaceEmbeddings
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
 # suppress the warning on parallelism
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
-device = "cuda"
+device = resolve_device()
 
 # Configuration
 WORKSPACE_DIR = os.getcwd()
@@ -37,6 +52,18 @@ MODEL_NAME = "openai/gpt-oss-20b"
 BASE_URL = "http://192.168.68.122:1234/v1"
 API_KEY = "lm-studio"
 
+_llm = None
+
+
+def get_llm():
+    """
+    the chat model of the planner and executor nodes, created once: its connection pool is kept alive across steps
+    """
+    global _llm
+    if _llm is None:
+        _llm = ChatOpenAI(base_url=BASE_URL, api_key=API_KEY, model=MODEL_NAME, temperature=0.0)
+    return _llm
+
 
 # ==============================================================================
 # LAYER 1: THE CONTEXT ENGINE
@@ -48,7 +75,7 @@ class CodeContextEngine:
         self.graph = nx.DiGraph()
         self.embeddings = HuggingFaceEmbeddings(
             model_name="thenlper/gte-large",
-            model_kwargs={"device": device}  # Use "cuda" or remove for CPU
+            model_kwargs={"device": device}
         )
         self.vector_store = Chroma(
             collection_name="codebase_index",
@@ -334,7 +361,7 @@ class AgentState(TypedDict):
 
 def planner_node(state: AgentState):
     print("🧠 Planner: Creating plan...")
-    llm = ChatOpenAI(base_url=BASE_URL, api_key=API_KEY, model=MODEL_NAME, temperature=0.0)
+    llm = get_llm()
     system_prompt = (
         "You are an experienced planner whose responsibility is to create step by step plans for others to execute. "
         "Analyze the user request and create a concise, step-by-step implementation plan. "
@@ -379,7 +406,7 @@ If the user asks you to “add”, “update”, “save”, etc., you MUST conv
 
 def executor_node(state: AgentState):
     print("🤖 Executor: Acting on plan...")
-    llm = ChatOpenAI(base_url=BASE_URL, api_key=API_KEY, model=MODEL_NAME, temperature=0.0).bind_tools(tools)
+    llm = get_llm().bind_tools(tools)
     system_prompt = (
         f"Plan: {state.get('plan', 'No plan')}\n"
         "You are a Senior Python Developer. Use tools to implement the plan. "
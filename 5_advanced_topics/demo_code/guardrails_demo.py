@@ -15,7 +15,7 @@ from langchain_core.messages import (
     BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
 )
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
+from core.session1_foundations.llm_clients import get_chat_model
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
 
@@ -65,10 +65,11 @@ class GuardedState(TypedDict):
 
 
 # === 3. MODELS ===
-model = ChatOpenAI(base_url=BASE_URL, temperature=0.0, api_key="lm-studio")
+# both models share one keep-alive connection pool to BASE_URL
+model = get_chat_model(BASE_URL, api_key="lm-studio", temperature=0.0)
 model_with_tools = model.bind_tools(tools)
 
-safety_model = ChatOpenAI(base_url=BASE_URL, temperature=0.0, api_key="lm-studio")
+safety_model = get_chat_model(BASE_URL, api_key="lm-studio", temperature=0.0)
 
 
 # === 4. GUARDRAIL NODES (FIXED) ===